@@ -1,7 +1,12 @@
 ''' 
 R to python: yourRank.r
 '''
+import os
 import math
+import time
+import logging
+import threading
+from collections import defaultdict, OrderedDict
 from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 
@@ -13,12 +18,93 @@ from exceptions import *
 from datastore import dataStore
 import population
 
-from utils import relativedelta_to_decimal_years
+from utils import relativedelta_to_decimal_years, LockedLazyObject, is_loaded
+from lrucache import LRUCache
+from timing import timed, span
 
 from django.conf import settings
 
-pop_year = population.NpSingleYearPopulationModel(settings.CSV_POPULATION_PATH, check_or_create_pickle=True)
-pop_day = population.BicubicSplineDailyPopulationModel(pop_year)
+logger = logging.getLogger(__name__)
+
+
+# the tables of the first steps of the searches by rank, see population.BicubicSplineDailyPopulationModel.get_inverse_table()
+inverseTableCache = LRUCache(256, 16 * 1024 * 1024)
+
+def _createDailyPopulationModel():
+    model = population.BicubicSplineDailyPopulationModel(pop_year, span=span, inverse_table_cache=inverseTableCache)
+    if settings.PRELOAD_MODELS:
+        model.build_all_models(settings.MODEL_CACHE_PATH)
+    return model
+
+# the population models are only loaded when they're first used, see preload() for loading them up front
+pop_year = LockedLazyObject(lambda: population.NpSingleYearPopulationModel(settings.CSV_POPULATION_PATH, check_or_create_cache=True, dtype=settings.POPULATION_DTYPE))
+pop_day = LockedLazyObject(_createDailyPopulationModel)
+
+# the range of dates supported by totalPopulation()
+TOTAL_POPULATION_DATE_RANGE = (date(2013, 1, 1), date(2022, 12, 31))
+
+def _createTotalPopulationTable():
+    if os.path.isfile(settings.TOTAL_POPULATION_TABLE_PATH):
+        table = population.PopulationTotalsTable.load(settings.TOTAL_POPULATION_TABLE_PATH)
+        if table.is_built_from(pop_day) and table.get_date_range() == tuple(population.to_epoch_days(day) for day in TOTAL_POPULATION_DATE_RANGE):
+            return table
+        logger.warning('The total population table in %s does not match the population data, rebuilding it', settings.TOTAL_POPULATION_TABLE_PATH)
+    return buildTotalPopulationTable()
+
+def buildTotalPopulationTable():
+    """
+    Calculates the total population of all countries on all days supported by totalPopulation(), see population.PopulationTotalsTable.
+    """
+    start = time.time()
+    date_from, date_to = (population.to_epoch_days(day) for day in TOTAL_POPULATION_DATE_RANGE)
+    table = population.PopulationTotalsTable.build(pop_day, 'All', date_from, date_to)
+    logger.info('Built the total population table of %i countries in %.02f seconds', len(table.regions), time.time() - start)
+    return table
+
+# the total populations served by totalPopulation(), which are loaded from the file built by the buildmodels command if it exists
+totalPopulationTable = LockedLazyObject(_createTotalPopulationTable)
+
+# set as soon as preload() has finished
+dataLoaded = threading.Event()
+
+# the results of worldPopulationRankByDate() and dateByWorldPopulationRank(), which are pure functions of their arguments
+rankCache = LRUCache(settings.RANK_CACHE_MAX_ENTRIES, settings.RANK_CACHE_MAX_BYTES)
+
+
+def preload():
+    """
+    Loads all data and builds all interpolation models up front, instead of on the first requests that need them. Run in the gunicorn
+    master process (see population_io/wsgi.py and gunicorn's --preload option), this means that the forked workers share all these
+    memory pages copy-on-write instead of each loading their own copy. The bulk of the data is in numpy arrays, which are never written
+    to after loading, so their pages stay shared.
+    """
+    start = time.time()
+    countries = dataStore.countries   # reads the CSVs of the data store
+    pop_day.build_all_models(settings.MODEL_CACHE_PATH)
+    totalPopulationTable.get_date_range()   # loads the table from its file, or builds it if the file is missing or outdated
+    if totalPopulationTable.filename is None:
+        totalPopulationTable.save(settings.TOTAL_POPULATION_TABLE_PATH)
+    # read the population cube once, so that a memory mapped cube is in the page cache before the workers start
+    for region in pop_year.get_regions():
+        for sex in pop_year.get_sexes():
+            pop_year.pop_grid(region, sex).sum()
+    logger.info('Preloaded the data of %i countries and %i interpolation models in %.02f seconds', len(countries), len(pop_year.get_regions()) * len(pop_year.get_sexes()), time.time() - start)
+    dataLoaded.set()
+
+def preloadInBackground():
+    """
+    Runs preload() in a background thread, so that the server can accept requests (e.g. health checks) right away. Requests which need
+    data before it has been loaded simply wait for it.
+    """
+    thread = threading.Thread(target=preload, name='preload')
+    thread.daemon = True
+    thread.start()
+
+def isDataLoaded():
+    """
+    Whether all data has been loaded, either by preload() or on demand by earlier requests, without loading anything.
+    """
+    return dataLoaded.is_set() or all(is_loaded(lazyObject) for lazyObject in (dataStore, pop_year, pop_day, totalPopulationTable))
 
 SEXES = {'male': 'M', 'female': 'F', 'unisex': 'All',}
 
@@ -38,15 +124,19 @@ def inPosixDays(date):
 ###
 ### 
 
-def worldPopulationRankByDate(sex, region, dob, refdate):
+@timed('validate')
+def _validateCountry(country):
     """
-    my rank by date: What will be my rank on particular day
+    Raises an InvalidCountryError if the country is not in the dataset, suggesting the right name if it was only spelled differently.
+    """
+    if country not in dataStore.regions:
+        raise InvalidCountryError(country, dataStore.regions.lookup(country))
 
-    :param sex:
-    :param region:
-    :param dob:
-    :param refdate:
-    :return:
+
+@timed('validate')
+def _validateRankByDateArguments(sex, region, dob, refdate):
+    """
+    Checks the arguments of a rank by date calculation and raises the appropriate API exception if any of them is invalid.
     """
     # check that all arguments have the right type (even though it's not very pythonic)
     if not isinstance(sex, basestring) or not isinstance(region, basestring) or not isinstance(dob, date) or not isinstance(refdate, date):
@@ -55,8 +145,7 @@ def worldPopulationRankByDate(sex, region, dob, refdate):
     # confirm that sex and region contain valid values
     if sex not in SEXES:
         raise InvalidSexError(sex)
-    if region not in dataStore.countries:
-        raise InvalidCountryError(region)
+    _validateCountry(region)
 
     # check the various date requirements
     today = datetime.utcnow().date()
@@ -67,14 +156,50 @@ def worldPopulationRankByDate(sex, region, dob, refdate):
     if (refdate - dob).days > 36500:
         raise CalculationTooWideError(refdate)
 
-    return pop_day.pop_sum_dob(
-        population.to_epoch_days(refdate),
-        region,
-        SEXES[sex],
-        dob_from = population.to_epoch_days(dob),
-        dob_to = population.to_epoch_days(refdate)
+def worldPopulationRankByDate(sex, region, dob, refdate):
+    """
+    my rank by date: What will be my rank on particular day
+
+    :param sex:
+    :param region:
+    :param dob:
+    :param refdate:
+    :return:
+    """
+    _validateRankByDateArguments(sex, region, dob, refdate)
+
+    dobDays, refdateDays = population.to_epoch_days(dob), population.to_epoch_days(refdate)
+    return rankCache.getOrCompute(
+        ('rank', SEXES[sex], region, dobDays, refdateDays),
+        lambda: pop_day.pop_sum_dob(refdateDays, region, SEXES[sex], dob_from=dobDays, dob_to=refdateDays)
     )
 
+def worldPopulationRankByDateBatch(queries):
+    """
+    my rank by date for many people at once: the same calculation as worldPopulationRankByDate(), but for a whole list of
+    queries. The queries are grouped by region and sex, so that the ranks of every group are calculated in one vectorized step.
+
+    :param queries: a list of (sex, region, dob, refdate) tuples
+    :return: a list of ranks, in the same order as the queries
+    """
+    # validate everything first, so that we don't do any calculations for a batch which is going to fail anyway
+    groups = defaultdict(list)
+    for index, (sex, region, dob, refdate) in enumerate(queries):
+        try:
+            _validateRankByDateArguments(sex, region, dob, refdate)
+        except ParseError as e:
+            e.detail = 'Query #%i: %s' % (index, e.detail)
+            raise
+        groups[(region, SEXES[sex])].append(index)
+
+    ranks = [None] * len(queries)
+    for (region, sex), indices in groups.iteritems():
+        dates = [population.to_epoch_days(queries[index][3]) for index in indices]
+        dobs = [population.to_epoch_days(queries[index][2]) for index in indices]
+        for index, rank in zip(indices, pop_day.pop_sum_dob_array(dates, region, sex, dobs, dates).tolist()):
+            ranks[index] = rank
+    return ranks
+
 def dateByWorldPopulationRank(sex, region, dob, rank):
     """
     finding the date for specific rank
@@ -90,16 +215,38 @@ def dateByWorldPopulationRank(sex, region, dob, rank):
     # confirm that sex and region contain valid values
     if sex not in SEXES:
         raise InvalidSexError(sex)
-    if region not in dataStore.countries:
-        raise InvalidCountryError(region)
+    _validateCountry(region)
 
     # check the various date requirements
     if dob < date(1920, 1, 1) or dob > date(2079, 12, 31):   # the end date has been chosen arbitrarily and is probably wrong
         raise BirthdateOutOfRangeError(dob, 'between 1920-01-01 and 2079-12-31')
 
-    return population.from_epoch_days(pop_day.pop_sum_dob_inverse_date(rank, region, SEXES[sex], population.to_epoch_days(dob)))
+    dobDays = population.to_epoch_days(dob)
+    return population.from_epoch_days(rankCache.getOrCompute(
+        ('date', SEXES[sex], region, dobDays, rank),
+        lambda: pop_day.pop_sum_dob_inverse_date(rank, region, SEXES[sex], dobDays)
+    ))
 
-def lifeExpectancyRemaining(sex, region, refdate, age):
+# Age group starting at and less than the next value: 0, 1, 5, 10, ..., 125
+LIFE_EXPECTANCY_AGES = np.insert(np.arange(5, 130, 5), 0, [0, 1]).astype(float)
+
+def lifeExpectancyAgeSpline(region, sexCode, period):
+    """
+    Returns the spline interpolating the life expectancy over age in the 5 yearly period starting in the given year, which is fitted once
+    and then cached in the data store.
+    """
+    key = (region, sexCode, int(period))
+    spline = dataStore.life_expectancy_splines.get(key)
+    if spline is None:
+        spline = InterpolatedUnivariateSpline(LIFE_EXPECTANCY_AGES, dataStore.life_expectancy_values[dataStore.life_expectancy_index[key]])
+        dataStore.life_expectancy_splines[key] = spline
+    return spline
+
+@timed('validate')
+def _validateLifeExpectancyArguments(sex, region, refdate, age):
+    """
+    Checks the arguments of a remaining life expectancy calculation and raises the appropriate API exception if any of them is invalid.
+    """
     # check that all arguments have the right type (even though it's not very pythonic)
     if not isinstance(sex, basestring) or not isinstance(region, basestring) or not isinstance(refdate, date) or not isinstance(age, relativedelta):
         raise TypeError('One or more arguments did not match the expected parameter type')
@@ -107,8 +254,7 @@ def lifeExpectancyRemaining(sex, region, refdate, age):
     # confirm that sex and region contain valid values
     if sex not in SEXES_LIFE_EXPECTANCY:
         raise InvalidSexError(sex)
-    if region not in dataStore.countries:
-        raise InvalidCountryError(region)
+    _validateCountry(region)
 
     # check the various date requirements
     if refdate < date(1955, 1, 1) or refdate >= date(2095, 1, 1):
@@ -119,55 +265,51 @@ def lifeExpectancyRemaining(sex, region, refdate, age):
     if refdate - age > date(2015, 6, 30):
         raise EffectiveBirthdateOutOfRangeError(invalidValue=(refdate-age))
 
-    # find beginning of 5 yearly period for the le_date
-    le_yr = refdate.year
-    lowest_year = math.floor(int(le_yr)/5)*5
-
-    # extract a row corresponding to the time-period
-    life_exp_prd_5below = dataStore.life_expectancy_ages[(dataStore.life_expectancy_ages.region == region) & (dataStore.life_expectancy_ages.sex == SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.life_expectancy_ages.Begin_prd == lowest_year-5)]
-    life_exp_prd_ext = dataStore.life_expectancy_ages[(dataStore.life_expectancy_ages.region == region) & (dataStore.life_expectancy_ages.sex == SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.life_expectancy_ages.Begin_prd == lowest_year)]
-    life_exp_prd_5above = dataStore.life_expectancy_ages[(dataStore.life_expectancy_ages.region == region) & (dataStore.life_expectancy_ages.sex == SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.life_expectancy_ages.Begin_prd == lowest_year+5)]
-
-    # life_exp_prd
-    life_exp_prd = pd.concat([life_exp_prd_5below, life_exp_prd_ext, life_exp_prd_5above])
-    life_exp_prd = life_exp_prd.ix[:,4:len(life_exp_prd.columns)]
-
-    # Place holder for Agenames and values for three consecutive periods of interest
-    life_exp_ = np.zeros((len(life_exp_prd.columns), 4))
-
-    # Age group starting at and less than the next value: 0, 1, 5, 10
-    life_exp_[:,0] = np.insert((np.arange(5, 130, 5)), 0, [0,1])
-
-    # transpose the dataframe - prep for assinging life expectancy vals
-    life_exp_prd = life_exp_prd.T
-
-    # Assigning life expectancy values
-    life_exp_[:,1] = life_exp_prd[life_exp_prd.columns[0]].values
-    life_exp_[:,2] = life_exp_prd[life_exp_prd.columns[1]].values
-    life_exp_[:,3] = life_exp_prd[life_exp_prd.columns[2]].values
-
-    # interpolations
-    xx_interp1 = InterpolatedUnivariateSpline(life_exp_[:,0],life_exp_[:,1])
-    xx_interp2 = InterpolatedUnivariateSpline(life_exp_[:,0],life_exp_[:,2])
-    xx_interp3 = InterpolatedUnivariateSpline(life_exp_[:,0],life_exp_[:,3])
+def lifeExpectancyRemaining(sex, region, refdate, age):
+    return lifeExpectancyRemainingArray(sex, region, [refdate], [age])[0]
 
-    # predictions
-    x_interp1 = xx_interp1(age_float)   #interpolated value for AGE in earlier 5 yearly period
-    x_interp2 = xx_interp2(age_float)   #interpolated value for AGE in the 5 yearly period of interest
-    x_interp3 = xx_interp3(age_float)   #interpolated value for AGE in 5 yearly period after
+def lifeExpectancyRemainingArray(sex, region, refdates, ages):
+    """
+    Calculates the remaining life expectancy of persons of the given sex and region for many reference dates and ages in one go, e.g. for
+    all ages on one date. Either both refdates and ages are lists of the same length, or one of them has a single element, which is used
+    with all elements of the other. Returns a numpy array of the same results as lifeExpectancyRemaining().
+    """
+    if len(refdates) == 1:
+        refdates = refdates * len(ages)
+    elif len(ages) == 1:
+        ages = ages * len(refdates)
+    if len(refdates) != len(ages):
+        raise ValueError('The lists of reference dates and ages must have the same length, or a single element')
+    for refdate, age in zip(refdates, ages):
+        _validateLifeExpectancyArguments(sex, region, refdate, age)
+
+    sexCode = SEXES_LIFE_EXPECTANCY[sex]
+    age_floats = np.array([relativedelta_to_decimal_years(age) for age in ages])
 
-    # matrix of vals
-    life_exp_yr = np.zeros((3,2))
+    # find beginning of 5 yearly period for the le_date
+    lowest_years = np.array([math.floor(int(refdate.year)/5)*5 for refdate in refdates])
 
     #The mid point of period 2010-2015 which is from 1st July 2010 to June 30 of 2015, therefore, the mid point is 1st Jan 2013
     #In the following we turn the year to the date and then to numeric. We will use these to interpolate between periods and then predict the le for exact date
     addDate = lambda d: inPosixDays(date(int(d)+3, 1, 1))
 
-    life_exp_yr[:,0] = [addDate(lowest_year-5), addDate(lowest_year), addDate(lowest_year+5)]
-    life_exp_yr[:,1] = [x_interp1, x_interp2, x_interp3]
-
-    life_exp_spl = InterpolatedUnivariateSpline(life_exp_yr[:,0], life_exp_yr[:,1], k=2)
-    return life_exp_spl(inPosixDays(refdate))[()]
+    refdate_days = np.array([inPosixDays(refdate) for refdate in refdates], dtype=float)
+    results = np.empty(len(refdates))
+    for lowest_year in np.unique(lowest_years):
+        indices = np.nonzero(lowest_years == lowest_year)[0]
+        periods = [lowest_year-5, lowest_year, lowest_year+5]
+
+        # predictions for all AGEs in the earlier 5 yearly period, the 5 yearly period of interest and the 5 yearly period after, with
+        # one spline evaluation per period
+        x_interp = np.array([lifeExpectancyAgeSpline(region, sexCode, period)(age_floats[indices]) for period in periods])
+
+        # a quadratic spline through the three periods is the quadratic polynomial through them, so instead of fitting one spline per
+        # element, we weight the periods with the Lagrange basis polynomials at all reference dates at once
+        period_dates = [float(addDate(period)) for period in periods]
+        x = refdate_days[indices]
+        weights = np.array([np.prod([(x - period_dates[j]) / (period_dates[i] - period_dates[j]) for j in range(3) if j != i], axis=0) for i in range(3)])
+        results[indices] = (weights * x_interp).sum(axis=0)
+    return results
 
 def lifeExpectancyTotal(sex, region, dob):
     if not isinstance(dob, date):
@@ -181,14 +323,17 @@ def lifeExpectancyTotal(sex, region, dob):
     refdate = dob + age
     return age_float + lifeExpectancyRemaining(sex, region, refdate, age)
 
-def populationCount(country, age=None, year=None):
+def populationCountColumns(country, age=None, year=None):
+    """
+    Returns the population table of populationCount() as columns, i.e. as a dict from the column names year, age, males, females and total
+    to numpy arrays, which are sliced directly out of the population grids of the country.
+    """
     # check that all arguments have the right type (even though it's not very pythonic)
     if not isinstance(country, basestring) or (age is not None and not isinstance(age, int)) or (year is not None and not isinstance(year, int)):
         raise TypeError('One or more arguments did not match the expected parameter type')
 
     # confirm that sex and region contain valid values
-    if country not in dataStore.countries:
-        raise InvalidCountryError(country)
+    _validateCountry(country)
 
     # check the various date requirements
     if age is None and year is None:   # note: age can be 0, so we have to check for None here, checking for truthyness is *not* sufficient!
@@ -198,17 +343,30 @@ def populationCount(country, age=None, year=None):
     if year is not None and (year < 1950 or year > 2100):
         raise DataOutOfRangeError('The year %i can not be processed, because only years between 1950 and 2100 are supported' % year)
 
-    results = []
-    for a in [age] if age else pop_year.ages():
-        for y in [year] if year else pop_year.dates():
-            results.append({
-                'year': y,
-                'age': a,
-                'males': pop_year.pop_age(y, country, 'M', a),
-                'females': pop_year.pop_age(y, country, 'F', a),
-                'total': pop_year.pop_age(y, country, 'All', a)
-            })
-    return results
+    minAge, maxAge = pop_year.get_age_range()
+    minYear, maxYear = pop_year.get_date_range()
+    ages = np.array([age]) if age else np.arange(minAge, maxAge + 1)
+    years = np.array([year]) if year else np.arange(minYear, maxYear + 1)
+    indices = np.ix_(ages - minAge, years - minYear)
+
+    # one row per age and year, ordered by age first
+    columns = OrderedDict()
+    columns['year'] = np.tile(years, len(ages))
+    columns['age'] = np.repeat(ages, len(years))
+    for column, sex in (('males', 'M'), ('females', 'F'), ('total', 'All')):
+        columns[column] = pop_year.pop_grid(country, sex)[indices].ravel().astype(np.int64)
+    return columns
+
+def populationCountRows(columns):
+    """
+    Generates the rows of a population table returned by populationCountColumns() as dicts, one after another.
+    """
+    names = columns.keys()
+    for values in zip(*[column.tolist() for column in columns.values()]):
+        yield dict(zip(names, values))
+
+def populationCount(country, age=None, year=None):
+    return list(populationCountRows(populationCountColumns(country, age, year)))
 
 def totalPopulation(country, refdate):
     # check that all arguments have the right type (even though it's not very pythonic)
@@ -216,14 +374,13 @@ def totalPopulation(country, refdate):
         raise TypeError('One or more arguments did not match the expected parameter type')
 
     # confirm that sex and region contain valid values
-    if country not in dataStore.countries:
-        raise InvalidCountryError(country)
+    _validateCountry(country)
 
     # check the various date requirements
-    if refdate < date(2013, 1, 1) or refdate > date(2022, 12, 31):
+    if refdate < TOTAL_POPULATION_DATE_RANGE[0] or refdate > TOTAL_POPULATION_DATE_RANGE[1]:
         raise CalculationDateOutOfRangeError(refdate, 'between 2013-01-01 and 2022-12-31')
 
-    return pop_day.pop_sum_age(population.to_epoch_days(refdate), country, 'All')
+    return totalPopulationTable.get(population.to_epoch_days(refdate), country)
 
 def continentBirthsByDate(continent, refdate):
     pass
@@ -232,8 +389,8 @@ def continentBirthsByDate(continent, refdate):
 #         raise TypeError('One or more arguments did not match the expected parameter type')
 #
 #     # confirm that sex and region contain valid values
-#     if continent not in dataStore.continent_countries:
-#         raise InvalidContinentError(continent)
+#     if continent not in dataStore.continents:
+#         raise InvalidContinentError(continent, dataStore.continents.lookup(continent))
 #
 #     # check the various date requirements
 #     if refdate < date(1950, 1, 1) or refdate > date(2100, 12, 31):
@@ -253,6 +410,53 @@ def continentBirthsByDate(continent, refdate):
 #
 #     return list(births_on_day)
 
+def _mortalityDistributionOfAgeBand(country, sexCode, flr_age, idate):
+    """
+    Calculates the mortality distribution of the 5 year age band starting at flr_age (before adjusting it to the exact age) on the given
+    day, as an array of the lower bounds of the age bands and the percentages of deaths in them.
+    """
+    # helper function
+    def setInterpDate(x, offset):
+        """ The posix days of Jan 1st in the middle of the 5 yearly period starting offset years after x """
+        return inPosixDays(date(x+offset+3, 1, 1))
+    def rounddown(x, base=5):
+        return int(base * math.floor(float(x)/base))
+
+    flr_yr = rounddown(idate.year, base=5)
+
+    # the age cohort: the survival ratios of age bands from flr_age-5 (or 0) onwards, in the periods in which the person reaches them
+    firstBand = (flr_age-5)/5 if flr_age >= 5 else 0
+    bands = np.arange(firstBand, dataStore.survival_ratio_values.shape[1])
+    lower_age = bands*5
+    def row(period):
+        # beyond the last projected period, the survival ratios of the last period are used
+        while (country, sexCode, period) not in dataStore.survival_ratio_index and period > flr_yr:
+            period -= 5
+        return dataStore.survival_ratio_index[(country, sexCode, period)]
+    def survivalRatios(firstPeriod):
+        rows = [row(firstPeriod + 5*i) for i in range(len(bands))]
+        return dataStore.survival_ratio_values[rows, bands]
+    pr = np.array([survivalRatios(flr_yr-10), survivalRatios(flr_yr-5), survivalRatios(flr_yr)])
+
+    # Interpolate for the input date (idate) with the quadratic through the three periods, for all age bands at once
+    dates = [setInterpDate(flr_yr, -5), setInterpDate(flr_yr, 0), setInterpDate(flr_yr, +5)]
+    x = inPosixDays(idate)
+    weights = np.array([(x - dates[1])*(x - dates[2]) / float((dates[0] - dates[1])*(dates[0] - dates[2])),
+                        (x - dates[0])*(x - dates[2]) / float((dates[1] - dates[0])*(dates[1] - dates[2])),
+                        (x - dates[0])*(x - dates[1]) / float((dates[2] - dates[0])*(dates[2] - dates[1]))])
+    pr_sx_date = weights.dot(pr)
+
+    # calc the % deaths, starting with 100% at the second band
+    death_percent = np.zeros(len(bands))
+    death_percent[1:] = np.cumprod(np.concatenate(([100.0], pr_sx_date[2:])))
+
+    # percentage deaths
+    dth_pc_after_exact_age = np.zeros(len(bands))
+    dth_pc_after_exact_age[1:-1] = death_percent[1:-1] - death_percent[2:]
+    dth_pc_after_exact_age[-1] = death_percent[-1]
+
+    return np.array([lower_age, dth_pc_after_exact_age])
+
 def calculateMortalityDistribution(country, sex, age):
     # check that all arguments have the right type (even though it's not very pythonic)
     if not isinstance(sex, basestring) or not isinstance(country, basestring) or not isinstance(age, relativedelta):
@@ -261,82 +465,30 @@ def calculateMortalityDistribution(country, sex, age):
     # confirm that sex and region contain valid values
     if sex not in SEXES_LIFE_EXPECTANCY:
         raise InvalidSexError(sex)
-    if country not in dataStore.countries:
-        raise InvalidCountryError(country)
+    _validateCountry(country)
     age_float = relativedelta_to_decimal_years(age)
     if age_float > 120:
         raise AgeOutOfRangeError(age)
 
-    # helper function
-    def setInterpDate(x, offset):
-        """ ??? """
-        idate = datetime.strptime(str(x+offset+3)+"/1"+"/1", "%Y/%m/%d")
-        return (idate - datetime(1970, 1, 1)).days
-    def rounddown(x, base=5):
-        return int(base * math.floor(float(x)/base))
-
-    # get columns which correspond to the inputs
+    # get closest age in 5 year windows
     idate = datetime.utcnow().date()
     iage = age_float
-    iyear = idate.year
-    flr_yr = rounddown(iyear, base=5)
-
-    # get closest age in 5 year windows
-    flr_age = rounddown(iage, base=5)
-
-    # Get the age cohort
-    if flr_age >= 5:
-        cohort_st = list(dataStore.survival_ratio.columns).index("X"+str(flr_age-5))
-    else:
-        cohort_st = 4
-    cohort_end = len(dataStore.survival_ratio.columns)
-    #cohort = dataStore.survival_ratio.loc[(dataStore.survival_ratio.region==country) & (dataStore.survival_ratio.sex==SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.survival_ratio.Begin_prd >=(flr_yr-5))].ix[:,cohort_st:cohort_end]
-
-    # get older and younger cohort
-    cohort_old = dataStore.survival_ratio.loc[(dataStore.survival_ratio.region==country) & (dataStore.survival_ratio.sex==SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.survival_ratio.Begin_prd >=(flr_yr-10))].ix[:,cohort_st:cohort_end]
-    #cohort_young = dataStore.survival_ratio.loc[(dataStore.survival_ratio.region==country) & (dataStore.survival_ratio.sex==SEXES_LIFE_EXPECTANCY[sex]) & (dataStore.survival_ratio.Begin_prd >=(flr_yr))].ix[:,cohort_st:cohort_end]
-
-    # get dates for the jan 1st for 3 years --> then to Unix timestamp
-    dates = [setInterpDate(flr_yr, -5), setInterpDate(flr_yr, 0), setInterpDate(flr_yr, +5)]
-
-    # make the output dataStore.survival_ratiotable
-    temp = np.zeros(shape=(len(cohort_old.columns),7))
-    odata = pd.DataFrame(temp, columns=["lower_age","pr0","pr1","pr2","pr_sx_date","death_percent","dth_pc_after_exact_age"])
-
-    # fill in with existing values
-    if iage>=5:
-        odata['lower_age'] = np.arange(flr_age-5, 130, 5)
-    else:
-        odata['lower_age'] = np.arange(0, 130, 5)
-    odata['pr0'] = np.matrix(cohort_old).diagonal().T
-    odata['pr1'] = np.matrix(cohort_old).diagonal(-1).T
-    odata['pr2'] = np.matrix(cohort_old).diagonal(-2).T
-
-    # Interpolate for the input date (idate)
-    odata["pr_sx_date"] = np.array([InterpolatedUnivariateSpline(dates,list(odata.ix[i,1:4]),k=2)(inPosixDays(idate)) for i in np.arange(0, len(cohort_old.columns),1)])
-
-    clen = len(odata)
-    # calc the % deaths
-    odata["death_percent"][1] = 100
-    for i in np.arange(2,clen,1):
-        odata["death_percent"][i] = odata["death_percent"][i-1]*odata["pr_sx_date"][i]
-
-    # percentage deaths
-    for i in np.arange(1,clen-1,1):
-        odata["dth_pc_after_exact_age"][i] = odata["death_percent"][i] - odata["death_percent"][i+1]
+    flr_age = int(5 * math.floor(iage/5))
 
-    odata["dth_pc_after_exact_age"][clen-1] = odata["death_percent"][clen-1]
+    # the distribution only depends on the age band and the day, so it is calculated once per day for every band
+    sexCode = SEXES_LIFE_EXPECTANCY[sex]
+    lower_age, dth_pc_after_exact_age = dataStore.mortality_distributions.getOrCompute((country, sexCode, flr_age, idate), lambda: _mortalityDistributionOfAgeBand(country, sexCode, flr_age, idate))
 
     # proportion of people who will die before iage
-    beforeDod = odata["dth_pc_after_exact_age"][1] * (iage - flr_age)/5
-    odata["dth_pc_after_exact_age"][1] = odata["dth_pc_after_exact_age"][1] - beforeDod
-    odata["dth_pc_after_exact_age"] = odata["dth_pc_after_exact_age"]* 100/odata["dth_pc_after_exact_age"].sum()
+    dth_pc_after_exact_age = dth_pc_after_exact_age.copy()
+    beforeDod = dth_pc_after_exact_age[1] * (iage - flr_age)/5
+    dth_pc_after_exact_age[1] = dth_pc_after_exact_age[1] - beforeDod
+    dth_pc_after_exact_age = dth_pc_after_exact_age* 100/dth_pc_after_exact_age.sum()
 
     # add 5 to each of the "ages"
     if iage>=5:
-        odata["lower_age"] = odata["lower_age"]+5
+        lower_age = lower_age+5
     else:
-        odata["lower_age"] = odata["lower_age"]+iage
+        lower_age = lower_age+iage
 
-    output = odata.ix[0:clen-1,['lower_age', 'dth_pc_after_exact_age']]
-    return list(output.values)
+    return list(np.column_stack((lower_age, dth_pc_after_exact_age)))
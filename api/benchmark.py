@@ -0,0 +1,273 @@
+import os, re, json, time, random, urllib, platform, resource, subprocess, threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import partial
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from django.test.client import Client
+from api import algorithms
+from api.utils import offset_to_str, view_name
+
+
+API_PREFIX = '/1.0'
+
+# the request line of an access log entry and its status code, e.g. "GET /1.0/countries/ HTTP/1.1" 200
+LOG_REQUEST_REGEX = re.compile(r'"GET (?P<path>/\S*) HTTP/[\d.]+"(?: (?P<status>\d{3}))?')
+
+
+class ParameterSampler(object):
+    """ Draws random but valid parameters for the API, with the distributions we see in practice: mostly persons born in the last 80 years,
+        a quarter of them asking about the whole world, and ages and dates around their lifetime.
+    """
+
+    def __init__(self, countries, seed=0):
+        self.countries = list(countries)
+        self.random = random.Random(seed)
+
+    def country(self):
+        if 'World' in self.countries and self.random.random() < 0.25:
+            return 'World'
+        return self.random.choice(self.countries)
+
+    def sex(self):
+        return self.random.choice(('male', 'female', 'unisex'))
+
+    def sexLifeExpectancy(self):
+        return self.random.choice(('male', 'female'))
+
+    def date(self, start, end):
+        return start + timedelta(days=self.random.randint(0, (end - start).days))
+
+    def dob(self):
+        return self.date(date(1935, 1, 1), date(2014, 12, 31))
+
+    def lifetimeDate(self, dob):
+        # a date on which the rank of a person can be calculated: up to 100 years after the birthdate, but within the projections
+        return self.date(max(dob, date(1950, 1, 1)), min(dob + timedelta(days=36500), date(2099, 12, 31)))
+
+    def age(self, minYears=1, maxYears=80):
+        return relativedelta(years=self.random.randint(minYears, maxYears), months=self.random.randint(0, 11))
+
+
+def _path(*parts):
+    return API_PREFIX + '/' + ''.join(urllib.quote(unicode(part).encode('utf-8')) + '/' for part in parts)
+
+def _rankPath(sampler, *parts):
+    return _path('wp-rank', sampler.dob(), sampler.sex(), sampler.country(), *parts)
+
+def _remainingLifeExpectancyPath(sampler):
+    refdate = sampler.date(date(1960, 1, 1), date(2060, 12, 31))
+    return _path('life-expectancy', 'remaining', sampler.sexLifeExpectancy(), sampler.country(), refdate, offset_to_str(sampler.age(max(1, refdate.year - 2014), 100)))
+
+def _rankBatch(sampler, size=100):
+    queries = []
+    for _ in range(size):
+        dob = sampler.dob()
+        queries.append({'dob': dob.isoformat(), 'sex': sampler.sex(), 'country': sampler.country(), 'date': sampler.lifetimeDate(dob).isoformat()})
+    return queries
+
+
+# the requests of the endpoint benchmarks, by the name of the view which answers them: functions which draw the path of a request, and
+# for POST requests its JSON body, from a ParameterSampler
+ENDPOINT_BENCHMARKS = OrderedDict([
+    ('list_countries', lambda sampler: (_path('countries'), None)),
+    ('world_population_rank_today', lambda sampler: (_rankPath(sampler, 'today'), None)),
+    ('world_population_rank_by_date', lambda sampler: (_rankPath(sampler, 'on', sampler.date(date(2015, 1, 1), date(2030, 12, 31))), None)),
+    ('world_population_rank_by_age', lambda sampler: (_rankPath(sampler, 'aged', offset_to_str(sampler.age())), None)),
+    ('world_population_rank_in_past', lambda sampler: (_rankPath(sampler, 'ago', '%iy' % sampler.random.randint(0, 10)), None)),
+    ('world_population_rank_in_future', lambda sampler: (_rankPath(sampler, 'in', offset_to_str(sampler.age(0, 30))), None)),
+    ('date_by_world_population_rank', lambda sampler: (_rankPath(sampler, 'ranked', sampler.random.randint(1, 10 ** sampler.random.randint(3, 9))), None)),
+    ('world_population_rank_batch', lambda sampler: (_path('wp-rank', 'batch'), _rankBatch(sampler))),
+    ('calculate_remaining_life_expectancy', lambda sampler: (_remainingLifeExpectancyPath(sampler), None)),
+    ('calculate_remaining_life_expectancy_curve', lambda sampler: (_path('life-expectancy', 'remaining', sampler.sexLifeExpectancy(), sampler.country(), sampler.date(date(2000, 1, 1), date(2015, 6, 30))) + '?ages=' + ','.join('%iy' % age for age in range(5, 101, 5)), None)),
+    ('total_life_expectancy', lambda sampler: (_path('life-expectancy', 'total', sampler.sexLifeExpectancy(), sampler.country(), sampler.date(date(1920, 1, 1), date(2015, 6, 30))), None)),
+    ('retrieve_population_table', lambda sampler: (_path('population', sampler.random.randint(1950, 2100), sampler.country()), None)),
+    ('retrieve_total_population', lambda sampler: (_path('population', sampler.country(), sampler.date(*algorithms.TOTAL_POPULATION_DATE_RANGE)), None)),
+    ('retrieve_total_population_now', lambda sampler: (_path('population', sampler.country(), 'today-and-tomorrow'), None)),
+    ('calculate_mortality_distribution', lambda sampler: (_path('mortality-distribution', sampler.country(), sampler.sexLifeExpectancy(), offset_to_str(sampler.age(1, 99)), 'today'), None)),
+    ('status', lambda sampler: (_path('status'), None)),
+])
+
+# the calls of the algorithm benchmarks: functions which draw the arguments of a call from a ParameterSampler and return it as a callable
+def _rankByDateCall(sampler):
+    dob = sampler.dob()
+    return partial(algorithms.worldPopulationRankByDate, sampler.sex(), sampler.country(), dob, sampler.lifetimeDate(dob))
+
+def _lifeExpectancyRemainingCall(sampler):
+    refdate = sampler.date(date(1960, 1, 1), date(2060, 12, 31))
+    return partial(algorithms.lifeExpectancyRemaining, sampler.sexLifeExpectancy(), sampler.country(), refdate, sampler.age(max(1, refdate.year - 2014), 100))
+
+ALGORITHM_BENCHMARKS = OrderedDict([
+    ('worldPopulationRankByDate', _rankByDateCall),
+    ('dateByWorldPopulationRank', lambda sampler: partial(algorithms.dateByWorldPopulationRank, sampler.sex(), sampler.country(), sampler.dob(), sampler.random.randint(1, 10 ** sampler.random.randint(3, 9)))),
+    ('lifeExpectancyRemaining', _lifeExpectancyRemainingCall),
+    ('lifeExpectancyTotal', lambda sampler: partial(algorithms.lifeExpectancyTotal, sampler.sexLifeExpectancy(), sampler.country(), sampler.date(date(1920, 1, 1), date(2015, 6, 30)))),
+    ('populationCount', lambda sampler: partial(algorithms.populationCount, sampler.country(), year=sampler.random.randint(1950, 2100))),
+    ('totalPopulation', lambda sampler: partial(algorithms.totalPopulation, sampler.country(), sampler.date(*algorithms.TOTAL_POPULATION_DATE_RANGE))),
+    ('calculateMortalityDistribution', lambda sampler: partial(algorithms.calculateMortalityDistribution, sampler.country(), sampler.sexLifeExpectancy(), sampler.age(1, 99))),
+])
+
+
+def iterRequestLog(filename):
+    """ Reads the GET requests of a log, and yields the name of the view which answers each of them, its path (including the query
+        string) and the status code it was answered with (or None if the log doesn't say), in the order of the log. Each line is either
+        a JSON object with the key path (and optionally status), an access log entry, or just a path. Lines which are none of these, and
+        paths outside of the API, are skipped.
+    """
+    with open(filename) as file:
+        for line in file:
+            line = line.strip()
+            status = None
+            if line.startswith('{'):
+                entry = json.loads(line)
+                path, status = entry.get('path'), entry.get('status')
+            else:
+                match = LOG_REQUEST_REGEX.search(line)
+                if match:
+                    path, status = match.group('path'), match.group('status')
+                else:
+                    path = line if line.startswith('/') else None
+            if not path or not path.startswith(API_PREFIX + '/'):
+                continue
+            try:
+                name = view_name(resolve(path.split('?')[0]).func)
+            except Resolver404:
+                continue
+            if name:
+                yield name, path, int(status) if status else None
+
+def readRequestLog(filename):
+    """ Reads the GET requests of a log like iterRequestLog(), and returns their paths grouped by view name. """
+    requests = OrderedDict()
+    for name, path, status in iterRequestLog(filename):
+        requests.setdefault(name, []).append(path)
+    return requests
+
+def clientHost():
+    """ Returns a host name for requests of the Django test client which passes the ALLOWED_HOSTS check. """
+    if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*':
+        return settings.ALLOWED_HOSTS[0].lstrip('.')
+    return 'testserver'
+
+
+def _failureSafe(call):
+    # errors count as failed calls, as the API would answer them with an error status (the test client raises them instead)
+    def run():
+        try:
+            return call()
+        except Exception:
+            return False
+    return run
+
+def _endpointCall(client, path, body):
+    if body is None:
+        return _failureSafe(lambda: client.get(path).status_code < 400)
+    return _failureSafe(lambda: client.post(path, json.dumps(body), content_type='application/json').status_code < 400)
+
+def _algorithmCall(call):
+    # an algorithm call succeeds unless it raises an error, whatever it returns
+    def run():
+        call()
+        return True
+    return _failureSafe(run)
+
+def endpointCalls(name, sampler, iterations, requestLog=None, host='testserver'):
+    """ Returns a list of callables which each send a request to an endpoint through the Django test client and return whether it
+        succeeded. The requests are drawn from the log if it contains any for the endpoint, otherwise from ENDPOINT_BENCHMARKS.
+    """
+    client = Client(HTTP_HOST=host)
+    if requestLog and requestLog.get(name):
+        return [_endpointCall(client, sampler.random.choice(requestLog[name]), None) for _ in range(iterations)]
+    return [_endpointCall(client, *ENDPOINT_BENCHMARKS[name](sampler)) for _ in range(iterations)]
+
+def algorithmCalls(name, sampler, iterations):
+    """ Returns a list of callables which each call an algorithm with arguments from ALGORITHM_BENCHMARKS and return whether it succeeded. """
+    return [_algorithmCall(ALGORITHM_BENCHMARKS[name](sampler)) for _ in range(iterations)]
+
+
+def _maxRss():
+    # the peak resident set size of this process in KiB (on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def runBenchmark(calls, warmup=0, concurrency=1):
+    """ Runs the calls (after running the first warmup of them without measuring them) in the given number of threads, and returns
+        the percentiles of their latencies in milliseconds, the throughput in calls per second, the number of failed calls and the
+        peak memory use of the process.
+    """
+    for call in calls[:warmup]:
+        call()
+    calls = calls[warmup:]
+    latencies = [None] * len(calls)
+    failures = []
+    remaining = iter(enumerate(calls))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                try:
+                    index, call = next(remaining)
+                except StopIteration:
+                    return
+            callStart = time.time()
+            success = call()
+            latencies[index] = time.time() - callStart
+            if not success:
+                failures.append(index)
+
+    rssBefore = _maxRss()
+    start = time.time()
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return OrderedDict([
+        ('calls', len(calls)),
+        ('failures', len(failures)),
+        ('p50_ms', round(p50, 3)),
+        ('p95_ms', round(p95, 3)),
+        ('p99_ms', round(p99, 3)),
+        ('mean_ms', round(latencies.mean(), 3) if len(latencies) else 0.0),
+        ('throughput_per_s', round(len(calls) / duration, 1) if duration else 0.0),
+        ('max_rss_kib', _maxRss()),
+        ('max_rss_growth_kib', _maxRss() - rssBefore),
+    ])
+
+
+def gitCommit():
+    """ Returns the hash of the checked out commit, or None if it can't be determined. """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def resultDocument(benchmarks, **parameters):
+    """ Returns the results of a benchmark run together with the environment they were measured in, as stored by the benchmark command. """
+    return OrderedDict([
+        ('commit', gitCommit()),
+        ('created', datetime.utcnow().isoformat() + 'Z'),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('parameters', parameters),
+        ('benchmarks', benchmarks),
+    ])
+
+def compareResults(baseline, results, threshold=1.2, metric='p50_ms'):
+    """ Compares the benchmarks of two result documents which both contain, and returns a list of (name, baseline value, value, ratio,
+        regressed) for each of them, where regressed means that the metric has grown by more than the threshold factor.
+    """
+    comparison = []
+    for name, stats in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before, after = baseline['benchmarks'][name][metric], stats[metric]
+        ratio = after / before if before else float('inf') if after else 1.0
+        comparison.append((name, before, after, ratio, ratio > threshold))
+    return comparison
@@ -1,11 +1,25 @@
 import os, time, logging
 import pandas as pd
 from django.conf import settings
+from api.utils import LockedLazyObject
+from api.lrucache import LRUCache
+from api.regions import RegionRegistry
 
 
 logger = logging.getLogger(__name__)
 
 
+def indexByRegionSexPeriod(table):
+    """ Returns the values of a table with the columns region, sex, Period, Begin_prd and then one column per age group as a numpy array of
+        the age group columns, and a dict mapping (region, sex, Begin_prd) to the row of each of them in that array.
+    """
+    values = table.iloc[:, 4:].values.astype(float)
+    index = {}
+    for row, (region, sex, period) in enumerate(zip(table.region, table.sex, table.Begin_prd)):
+        index.setdefault((region, int(sex), int(period)), row)
+    return values, index
+
+
 class HDF5DataStore(object):
     """ Alternative data store implementation, based on the HDF5 format. Potentially faster than the current CSV/filesystem-based implementation, but
         had occasional inexplicable HDF5ExtErrors with unclear causes.
@@ -30,6 +44,7 @@ class HDF5DataStore(object):
         self.data = self._store.get('data')
         self.life_expectancy_ages = self._store.get('life_expectancy_ages')
         self.countries = pd.unique(self.data.Location).tolist()
+        self.regions = RegionRegistry(self.countries)
         logger.info('Initialized data store in %.02f seconds', (time.clock()-start))
 
     def readCSVs(self):
@@ -37,6 +52,7 @@ class HDF5DataStore(object):
         self.data = pd.read_csv(settings.CSV_POPULATION_PATH)
         self.life_expectancy_ages = pd.read_csv(settings.CSV_LIFE_EXPECTANCY_PATH)
         self.countries = pd.unique(self.data.Location).tolist()
+        self.regions = RegionRegistry(self.countries)
         self._store.put('data', self.data)
         self._store.put('life_expectancy_ages', self.life_expectancy_ages)
         logger.info('Parsed CSVs in %.02f seconds', (time.clock()-start))
@@ -59,6 +75,9 @@ class HDF5DataStore(object):
         logger.info('Retrieved extrapolation table for (%s, %s) in %.02f seconds', sex, country, time.clock()-start)
         return table
 
+    def hasExtrapolationTable(self, sex, country):
+        return bool(self._store.get_node(self._buildTableKey(sex, country)))
+
     def generateExtrapolationTable(self, sex, country):
         start = time.clock()
         table = self._extrapolation_table_builder(sex, country)
@@ -88,7 +107,7 @@ class PickleDataStore(object):
         self._extrapolation_table_builder = builder
 
     def readCSVs(self):
-        start = time.clock()
+        start = time.time()
         # population by single year of age and year from 1950-2100
         # ?, LocID, Location (Country), VarID, Variant, Time, Age, pop male, pop female, pop total
         self.data = pd.read_csv(settings.CSV_POPULATION_PATH)
@@ -96,6 +115,7 @@ class PickleDataStore(object):
         # life expectancy in 5 year bands @ 5 year intervals (except age 1)
         # region, sex, period, period start year, x0, **x1**, x5, x10, x15,...
         self.life_expectancy_ages = pd.read_csv(settings.CSV_LIFE_EXPECTANCY_PATH)
+        self.indexLifeExpectancy()
         
         # daily population projections 2013-2022
         # country, date (Y/M/D), pop total
@@ -104,15 +124,34 @@ class PickleDataStore(object):
         # survival ratio in 5 year bands @ 5 year intervals
         # region, sex, period, period start year, x0, x5, x10, x15,...        
         self.survival_ratio = pd.read_csv(settings.CSV_SURVIVAL_RATIO_PATH)
+        self.indexSurvivalRatio()
         
         # continent, country mapping
         self.continent_countries = pd.read_csv(settings.CSV_CONTINENT_COUNTRIES)
+        self.continents = RegionRegistry(self.continent_countries.CONTINENT)
         
         # births per day by country 1950 - 2100
         self.births_day_country = pd.read_csv(settings.CSV_BIRTHS_DAY_COUNTRY)
         
         self.countries = pd.unique(self.data.Location).tolist()
-        logger.info('Parsed CSVs in %.02f seconds', (time.clock()-start))
+        self.regions = RegionRegistry(self.countries)
+        self.load_seconds = time.time() - start   # wall clock time, reported by the metrics
+        logger.info('Parsed CSVs in %.02f seconds', self.load_seconds)
+
+    def indexLifeExpectancy(self):
+        """ Indexes the life expectancy table for lookups by region, sex and the start year of the period: life_expectancy_values holds the
+            life expectancies by age group (the columns X0, X1, X5, ...) of every row, and life_expectancy_index maps (region, sex,
+            period) to a row of it. Also resets the cache of the age splines fitted to these rows, see algorithms.lifeExpectancyAgeSpline().
+        """
+        self.life_expectancy_values, self.life_expectancy_index = indexByRegionSexPeriod(self.life_expectancy_ages)
+        self.life_expectancy_splines = {}
+
+    def indexSurvivalRatio(self):
+        """ Indexes the survival ratio table in the same way as the life expectancy table, as survival_ratio_values (with the columns X0,
+            X5, X10, ...) and survival_ratio_index. Also resets the cache of the mortality distributions calculated from them.
+        """
+        self.survival_ratio_values, self.survival_ratio_index = indexByRegionSexPeriod(self.survival_ratio)
+        self.mortality_distributions = LRUCache(settings.MORTALITY_CACHE_MAX_ENTRIES, settings.MORTALITY_CACHE_MAX_BYTES)
 
     def __getitem__(self, item):
         sex, country = item
@@ -127,7 +166,11 @@ class PickleDataStore(object):
 
     def storeExtrapolationTable(self, sex, country, table):
         start = time.clock()
-        table.to_pickle(self._buildExtrapolationTableFilename(sex, country))
+        # write to a temporary file first and rename it, so that an interrupted build never leaves a truncated table behind
+        path = self._buildExtrapolationTableFilename(sex, country)
+        tempPath = '%s.%i.tmp' % (path, os.getpid())
+        table.to_pickle(tempPath)
+        os.rename(tempPath, path)
         logger.info('Stored extrapolation table for (%s, %s) in %.02f seconds', sex, country, time.clock()-start)
 
     def retrieveExtrapolationTable(self, sex, country):
@@ -136,7 +179,12 @@ class PickleDataStore(object):
         logger.info('Retrieved extrapolation table for (%s, %s) in %.02f seconds', sex, country, time.clock()-start)
         return table
 
+    def hasExtrapolationTable(self, sex, country):
+        return os.path.exists(self._buildExtrapolationTableFilename(sex, country))
+
     def generateExtrapolationTable(self, sex, country):
+        if getattr(self, '_extrapolation_table_builder', None) is None:
+            raise RuntimeError('No extrapolation table builder has been registered with the data store')
         start = time.clock()
         logger.info('Generating extrapolation table for (%s, %s)...', sex, country)
         table = self._extrapolation_table_builder(sex, country)
@@ -146,12 +194,11 @@ class PickleDataStore(object):
         return table
 
     def getOrGenerateExtrapolationTable(self, sex, country):
-        path = self._buildExtrapolationTableFilename(sex, country)
-        if os.path.exists(path):
+        if self.hasExtrapolationTable(sex, country):
             return self.retrieveExtrapolationTable(sex, country)
         else:
             return self.generateExtrapolationTable(sex, country)
 
 
-# the central data store instance we're gonna use
-dataStore = PickleDataStore()
+# the central data store instance we're gonna use, which only reads the CSVs when it's first used
+dataStore = LockedLazyObject(PickleDataStore)
@@ -1,11 +1,16 @@
-import functools
-from datetime import datetime
+import functools, hashlib
+from datetime import date, datetime, time
+from dateutil.relativedelta import relativedelta
 
 from django.conf import settings
+from django.core.cache import get_cache
 from django.utils.cache import patch_cache_control
 from django.views.decorators.cache import cache_control
+from rest_framework.response import Response
+from api.renderers import TableRenderer
 from api.exceptions import DateParsingError, OffsetParsingError, IntParsingError, FloatParsingError
-from api.utils import str_to_date, parse_offset
+from api.utils import str_to_date, parse_offset, offset_to_str
+from api.timing import span
 
 
 def build_decorator(conversion_function):
@@ -24,7 +29,8 @@ def build_decorator(conversion_function):
                 else:
                     # run the conversion
                     value = kwargs[param_name]
-                    new_value = conversion_function(param_name, value)
+                    with span('parse'):
+                        new_value = conversion_function(param_name, value)
 
                     # inject converted value into the original function
                     kwargs.update({param_name: new_value})
@@ -69,19 +75,23 @@ def cache_unlimited():
     """
     return cache_control(public=True, max_age=settings.CACHE_CONTROL_MAXAGE)
 
+def seconds_until_utc_eod(day):
+    """ Returns the number of seconds from now until the end of the given day in UTC, which is negative if that day is over """
+    utc_eod = datetime.combine(day, time(23, 59, 59))
+    return int((utc_eod - datetime.utcnow()).total_seconds())
+
+def calculate_max_age():
+    """ Returns the number of seconds until midnight UTC (or settings.CACHE_CONTROL_MAXAGE, in case that value is set to less than a day) """
+    positive_seconds_until_utc_eod = max(0, seconds_until_utc_eod(datetime.utcnow().date()))
+    max_age = min(positive_seconds_until_utc_eod, settings.CACHE_CONTROL_MAXAGE)
+    return max_age
+
 def cache_until_utc_eod():
     """
     Decorates a view function to set a Cache-Control header with an expiration date of midnight UTC (or maximum settings.CACHE_CONTROL_MAXAGE,
     in case that value is set to less than a day).
     """
 
-    def calculate_max_age():
-        utc_eod = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=0)
-        time_until_utc_eod = utc_eod - datetime.utcnow()
-        positive_seconds_until_utc_eod = max(0, int(time_until_utc_eod.total_seconds()))
-        max_age = min(positive_seconds_until_utc_eod, settings.CACHE_CONTROL_MAXAGE)
-        return max_age
-
     # modification of @django.views.decorators.cache.cache_control
     def _cache_controller(viewfunc):
         @functools.wraps(viewfunc)
@@ -92,3 +102,65 @@ def cache_until_utc_eod():
             return response
         return _cache_controlled
     return _cache_controller
+
+def canonicalize_param(value):
+    """ Returns a canonical string for a (converted) view parameter, so that e.g. the offsets 14m and 1y2m are recognized as the same """
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, relativedelta):
+        return offset_to_str(value)
+    return unicode(value)
+
+def response_cache_key(view_name, kwargs, utc_date=None):
+    """
+    Returns the cache key for the response of the view with the given dotted name, e.g. api.views.list_countries, to the given converted
+    parameters. Responses which depend on the current date are additionally keyed on the date they were calculated for.
+    """
+    if utc_date is not None:
+        kwargs = dict(kwargs, utc_date=utc_date)
+    params = '&'.join('%s=%s' % (name, canonicalize_param(value)) for name, value in sorted(kwargs.items()))
+    return 'response:%s:%s' % (view_name, hashlib.md5(params.encode('utf-8')).hexdigest())
+
+def store_response_until_utc_eod(view_name, kwargs, utc_date, data):
+    """ Stores the data of a response calculated for the given date, which expires at the end of that date in UTC """
+    timeout = seconds_until_utc_eod(utc_date)
+    if timeout > 0:
+        get_cache(settings.RESPONSE_CACHE_ALIAS).set(response_cache_key(view_name, kwargs, utc_date), data, timeout)
+
+def cache_response(until_utc_eod=False):
+    """
+    Decorates a view function to store the data of its successful responses in the cache settings.RESPONSE_CACHE_ALIAS, so that they can be
+    shared between processes and hosts, depending on the configured cache backend. Must be applied after all parameter conversion decorators,
+    as the cache key is built from the converted parameters.
+
+    Views which depend on the current date must set until_utc_eod, so that their responses expire at midnight UTC (the same moment as set by
+    cache_until_utc_eod).
+
+    Views which stream their response can set its data as the attribute cache_data to have it stored, cache hits are then answered with a
+    regular Response of that data.
+    """
+    def decorator(view_func):
+        view_name = '%s.%s' % (view_func.__module__, view_func.__name__)
+
+        @functools.wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            cache = get_cache(settings.RESPONSE_CACHE_ALIAS)
+            utc_date = datetime.utcnow().date() if until_utc_eod else None
+            # query parameters may change the response as well, and so does a table renderer (see api.renderers)
+            params = dict(kwargs, **dict(('query:%s' % name, value) for name, value in request.GET.items()))
+            if isinstance(getattr(request, 'accepted_renderer', None), TableRenderer):
+                params['renderer'] = request.accepted_renderer.format
+            data = cache.get(response_cache_key(view_name, params, utc_date))
+            if data is not None:
+                return Response(data)
+            response = view_func(request, *args, **kwargs)
+            data = response.data if isinstance(response, Response) else getattr(response, 'cache_data', None)
+            if data is not None and response.status_code == 200:
+                if until_utc_eod:
+                    # doesn't store anything if the day has ended while calculating the response
+                    store_response_until_utc_eod(view_name, params, utc_date, data)
+                else:
+                    cache.set(response_cache_key(view_name, params), data)
+            return response
+        return _wrapped_view
+    return decorator
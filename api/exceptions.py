@@ -8,12 +8,16 @@ class InvalidSexError(ParseError):
         self.detail = '%s is an invalid value for the parameter "sex", valid values are: male, female, unisex' % invalidValue
 
 class InvalidCountryError(ParseError):
-    def __init__(self, invalidValue):
+    def __init__(self, invalidValue, suggestion=None):
         self.detail = '%s is an invalid value for the parameter "country", the list of valid values can be retrieved from the endpoint /countries' % invalidValue
+        if suggestion:
+            self.detail += ' (did you mean %s?)' % suggestion
 
 class InvalidContinentError(ParseError):
-    def __init__(self, invalidValue):
+    def __init__(self, invalidValue, suggestion=None):
         self.detail = '%s is an invalid value for the parameter "continent", the list of valid values can be retrieved from the endpoint /continent_countries' % invalidValue
+        if suggestion:
+            self.detail += ' (did you mean %s?)' % suggestion
 
 class DateParsingError(ParseError):
     def __init__(self, paramName, invalidValue):
@@ -54,3 +58,11 @@ class AgeOutOfRangeError(ParseError):
 class DataOutOfRangeError(ParseError):
     def __init__(self, detail=None):
         self.detail = detail or 'The input data is out of range'
+
+class BatchParsingError(ParseError):
+    def __init__(self, reason):
+        self.detail = 'The batch request could not be parsed (%s). Please provide a JSON array of objects with the keys dob, sex, country and date' % reason
+
+class BatchTooLargeError(ParseError):
+    def __init__(self, size, maxSize):
+        self.detail = 'The batch request contains %i queries, but only up to %i queries per request are supported' % (size, maxSize)
@@ -0,0 +1,65 @@
+import sys, threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A thread-safe in-memory cache which evicts the least recently used entries once it holds more than maxEntries entries, or once
+        its entries take up more than (approximately) maxBytes bytes. It counts its hits, misses and evictions, see stats().
+    """
+
+    def __init__(self, maxEntries, maxBytes):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeOf(key, value):
+        # the shallow sizes of the key tuple, its items and the value, which is good enough for our small keys and values
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(key, tuple):
+            size += sum(sys.getsizeof(item) for item in key)
+        return size
+
+    def getOrCompute(self, key, compute):
+        """ Returns the value cached for the given key, or calls compute() to calculate and cache it. Exceptions are not cached. """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = value   # reinsert as the most recently used entry
+                return value
+
+        # compute outside of the lock, so that other threads don't have to wait for us
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = self._sizeOf(key, value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizeOf(key, self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.maxEntries or self._bytes > self.maxBytes):
+                oldKey, oldValue = self._entries.popitem(last=False)
+                self._bytes -= self._sizeOf(oldKey, oldValue)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ Returns the current number of entries and their approximate size in bytes, and the counters, as a dict. """
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
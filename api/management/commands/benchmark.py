@@ -0,0 +1,89 @@
+import json
+from collections import OrderedDict
+from optparse import make_option
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from api.datastore import dataStore
+from api import benchmark
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Measures the latency, throughput and memory use of every API endpoint and of the algorithms behind them, and compares them with earlier results'
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', dest='iterations', type='int', default=200, help='The number of measured calls per benchmark (default: 200)'),
+        make_option('--warmup', dest='warmup', type='int', default=10, help='The number of calls per benchmark before measuring (default: 10)'),
+        make_option('--concurrency', dest='concurrency', type='int', default=1, help='The number of threads which send the calls at the same time (default: 1)'),
+        make_option('--seed', dest='seed', type='int', default=0, help='The seed of the random parameters (default: 0)'),
+        make_option('--only', dest='only', default=None, help='Only run these benchmarks, separated by commas, e.g. world_population_rank_today,totalPopulation'),
+        make_option('--kind', dest='kind', type='choice', choices=['all', 'endpoints', 'algorithms'], default='all', help='Run the benchmarks of the endpoints, of the algorithms or of both (default: all)'),
+        make_option('--log', dest='log', default=None, help='Draw the requests of the endpoints from this log of requests instead of random parameters'),
+        make_option('--no-preload', dest='preload', action='store_false', default=True, help='Do not load all data before measuring'),
+        make_option('--output', dest='output', default=None, help='Store the results as JSON in this file'),
+        make_option('--compare', dest='compare', default=None, help='Compare the results with those stored in this file, and fail if any benchmark has become slower'),
+        make_option('--threshold', dest='threshold', type='float', default=1.2, help='The factor by which the median latency may grow before --compare fails (default: 1.2)'),
+    )
+
+    def handle(self, *args, **options):
+        from api.algorithms import preload, rankCache, inverseTableCache
+
+        if options['iterations'] < 1 or options['warmup'] < 0 or options['concurrency'] < 1:
+            raise CommandError('The iterations and concurrency must be at least 1, and the warmup must not be negative')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+
+        requestLog = benchmark.readRequestLog(options['log']) if options['log'] else None
+        endpoints = list(benchmark.ENDPOINT_BENCHMARKS) + [name for name in requestLog or [] if name not in benchmark.ENDPOINT_BENCHMARKS]
+        benchmarks = []
+        if options['kind'] in ('all', 'endpoints'):
+            benchmarks += [(name, 'endpoint') for name in endpoints]
+        if options['kind'] in ('all', 'algorithms'):
+            benchmarks += [(name, 'algorithm') for name in benchmark.ALGORITHM_BENCHMARKS]
+        if options['only']:
+            only = set(name.strip() for name in options['only'].split(','))
+            unknown = only - set(name for name, kind in benchmarks)
+            if unknown:
+                raise CommandError('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+            benchmarks = [(name, kind) for name, kind in benchmarks if name in only]
+
+        if options['preload']:
+            self.stdout.write('Loading all data...')
+            preload()
+
+        count = options['iterations'] + options['warmup']
+        results = OrderedDict()
+        for name, kind in benchmarks:
+            # every benchmark starts without cached results, so that they don't depend on each other
+            get_cache(settings.RESPONSE_CACHE_ALIAS).clear()
+            rankCache.clear()
+            inverseTableCache.clear()
+            dataStore.mortality_distributions.clear()
+
+            sampler = benchmark.ParameterSampler(dataStore.countries, options['seed'])
+            if kind == 'endpoint':
+                calls = benchmark.endpointCalls(name, sampler, count, requestLog, benchmark.clientHost())
+            else:
+                calls = benchmark.algorithmCalls(name, sampler, count)
+            stats = benchmark.runBenchmark(calls, options['warmup'], options['concurrency'])
+            stats['kind'] = kind
+            results[name] = stats
+            self.stdout.write('%-42s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %8.1f/s  %i failed' % (name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_per_s'], stats['failures']))
+
+        document = benchmark.resultDocument(results, iterations=options['iterations'], warmup=options['warmup'], concurrency=options['concurrency'],
+            seed=options['seed'], log=options['log'], preload=options['preload'])
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(document, file, indent=2)
+            self.stdout.write('Stored the results in %s.' % options['output'])
+
+        if baseline is not None:
+            self.stdout.write('Compared with %s (commit %s):' % (options['compare'], baseline.get('commit')))
+            comparison = benchmark.compareResults(baseline, document, options['threshold'])
+            for name, before, after, ratio, regressed in comparison:
+                self.stdout.write('%-42s p50 %8.2f ms -> %8.2f ms  %+6.0f%%%s' % (name, before, after, (ratio - 1) * 100, '  SLOWER' if regressed else ''))
+            regressions = [name for name, before, after, ratio, regressed in comparison if regressed]
+            if regressions:
+                raise CommandError('%i benchmarks have become slower by more than a factor of %.2f: %s' % (len(regressions), options['threshold'], ', '.join(regressions)))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Rebuilds the interpolation models of all countries and sexes and the total population table, and stores them in their cache files'
+
+    def handle(self, *args, **kwargs):
+        from api.algorithms import pop_day, buildTotalPopulationTable
+
+        # throw away any models that have been loaded from an older cache file
+        pop_day.models.clear()
+
+        self.stdout.write('Building the interpolation models...')
+        start = time.time()
+        pop_day.build_all_models()
+        self.stdout.write('Built %i models in %.02f seconds.' % (sum(len(models) for models in pop_day.models.values()), time.time()-start))
+
+        pop_day.save_models(settings.MODEL_CACHE_PATH)
+        self.stdout.write('Stored the models in %s.' % settings.MODEL_CACHE_PATH)
+
+        self.stdout.write('Building the total population table...')
+        table = buildTotalPopulationTable()
+        mismatches = table.check(pop_day)
+        if mismatches:
+            raise CommandError('The total population table differs from the interpolation models, e.g. %s on day %i: %i instead of %i' % mismatches[0])
+        table.save(settings.TOTAL_POPULATION_TABLE_PATH)
+        self.stdout.write('Stored the total population table in %s.' % settings.TOTAL_POPULATION_TABLE_PATH)
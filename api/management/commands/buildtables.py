@@ -1,40 +1,125 @@
-import time
-from django.core.management.base import BaseCommand
+import os, json, time, multiprocessing
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from api.datastore import dataStore
 
 
+MANIFEST_FILENAME = 'buildtables-manifest.json'
+
+
+def _generateTable(key):
+    """ Generates and stores the extrapolation table of a (sex, country) key, and returns the key and the time it took. This runs in the
+        worker processes, which inherit the data store (including the registered table builder) from the command.
+    """
+    sex, country = key
+    start = time.time()
+    dataStore.generateExtrapolationTable(sex, country)   # the table isn't kept in memory, it's stored by the data store
+    return key, time.time() - start
+
+
 class Command(BaseCommand):
     args = ''
-    help = 'Regenerates all extrapolation tables'
+    help = 'Regenerates all extrapolation tables. An interrupted run continues where it stopped when the command is called again.'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=1, help='The number of processes which generate tables in parallel (default: 1)'),
+        make_option('--only', dest='only', default=None, help='Only regenerate the tables of these countries, separated by commas'),
+        make_option('--skip-existing', dest='skip_existing', action='store_true', default=False, help='Do not regenerate tables which already exist'),
+        make_option('--restart', dest='restart', action='store_true', default=False, help='Ignore the progress of an interrupted run and start over'),
+    )
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
         # it's important to import this to register the table builder with the data store
         import api.algorithms
 
         # we certainly don't want to cache 25 GiB of tables in memory
         settings.CACHE_TABLES_IN_MEMORY = False
 
-        self.stdout.write('This command will regenerate all the extrapolation tables. Existing tables will be overwritten.')
-        self.stdout.write('Please note that you should have about 25 GiB of free disk space.')
+        if options['workers'] < 1:
+            raise CommandError('The number of workers must be at least 1')
+        if not settings.DATA_STORE_WRITABLE:
+            raise CommandError('The data store is not writable, see POPULATIONIO_DATASTORE_WRITABLE')
 
         self.stdout.write('Rereading CSV to make sure we have the latest version of the dataset...')
         dataStore.readCSVs()
 
-        sexes = api.algorithms.SEXES.keys()
         countries = dataStore.countries
-        totalCount = len(sexes)*len(countries)
-        self.stdout.write('Regenerating %i extrapolation tables... this will take a while!' % totalCount)
+        if options['only']:
+            countries = []
+            for name in options['only'].split(','):
+                country = dataStore.regions.lookup(name)
+                if country is None:
+                    raise CommandError('Unknown country %s' % name.strip())
+                countries.append(country)
+
+        keys = [(sex, country) for sex in sorted(api.algorithms.SEXES) for country in countries]
+        allKeys = set((sex, country) for sex in api.algorithms.SEXES for country in dataStore.countries)
+        manifestPath = os.path.join(settings.DATA_STORE_PATH, MANIFEST_FILENAME)
+        completed = set()
+        resuming = os.path.exists(manifestPath) and not options['restart']
+        if resuming:
+            completed = self._readManifest(manifestPath)
+            self.stdout.write('Continuing an interrupted run, which has already regenerated %i tables (use --restart to start over)...' % len(completed))
+        pending = [key for key in keys if key not in completed]
+        if options['skip_existing']:
+            existing = [key for key in pending if dataStore.hasExtrapolationTable(*key)]
+            completed.update(existing)
+            pending = [key for key in pending if key not in completed]
+        if not pending:
+            self._finishManifest(manifestPath, completed, allKeys, resuming or not options['only'])
+            self.stdout.write('All tables are up to date.')
+            return
+
+        self.stdout.write('This command will regenerate %i extrapolation tables. Existing tables will be overwritten.' % len(pending))
+        self.stdout.write('Please note that you should have about 25 GiB of free disk space for all tables.')
+        self.stdout.write('Regenerating the tables with %i worker processes... this will take a while!' % options['workers'])
 
+        if options['workers'] > 1:
+            # the workers are forked from this process, so they share the data which has been read already
+            pool = multiprocessing.Pool(options['workers'])
+            results = pool.imap_unordered(_generateTable, pending)
+        else:
+            pool = None
+            results = (_generateTable(key) for key in pending)
+
+        start = time.time()
         counter = 0
-        calculationTimes = []
-        for sex in sexes:
-            for region in countries:
-                start = time.clock()
-                table = dataStore.generateExtrapolationTable(sex, region)
-                table = None   # delete from memory immediately
-                calculationTimes.append(time.clock() - start)
+        try:
+            for key, duration in results:
+                completed.add(key)
+                self._writeManifest(manifestPath, completed)
                 counter += 1
-                avgCalcTime = sum(calculationTimes)/len(calculationTimes)
-                estimation = max(1.0, (totalCount - counter) * avgCalcTime / 60)
-                self.stdout.write('Generated %i / %i tables, estimating %i minutes left.' % (counter, totalCount, estimation))
+                # the tables are generated in parallel, so the wall clock time is the best estimate for the remaining ones
+                estimation = max(1.0, (len(pending) - counter) * (time.time() - start) / counter / 60)
+                self.stdout.write('Generated %i / %i tables (%s, %s in %.02f seconds), estimating %i minutes left.' % (counter, len(pending), key[0], key[1], duration, estimation))
+        except RuntimeError as e:
+            raise CommandError('%s. The progress has been saved, call the command again to continue.' % e)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        self._finishManifest(manifestPath, completed, allKeys, resuming or not options['only'])
+        self.stdout.write('Regenerated %i tables in %.02f seconds.' % (counter, time.time() - start))
+
+    def _finishManifest(self, path, completed, allKeys, keep):
+        """ Removes the manifest once the tables of all countries have been regenerated. Until then, it is kept if it records the progress
+            of a run over all countries (possibly continued with --only), so that the next run continues it, but not for a run of --only
+            countries which didn't continue anything.
+        """
+        if completed >= allKeys or not keep:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            self._writeManifest(path, completed)
+
+    def _readManifest(self, path):
+        with open(path) as file:
+            return set(tuple(key) for key in json.load(file)['completed'])
+
+    def _writeManifest(self, path, completed):
+        # like the tables, the manifest is replaced atomically, so that it's never truncated when the command is interrupted
+        tempPath = '%s.%i.tmp' % (path, os.getpid())
+        with open(tempPath, 'w') as file:
+            json.dump({'completed': sorted(completed)}, file)
+        os.rename(tempPath, path)
@@ -0,0 +1,43 @@
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from api.datastore import dataStore
+from api.decorators import store_response_until_utc_eod
+from api.exceptions import ParseError
+from api.utils import str_to_date
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Calculates the total population responses of all countries for the next day (UTC) ahead of time and stores them in the response cache'
+    option_list = BaseCommand.option_list + (
+        make_option('--date', dest='date', default=None, help='The day to prepare the responses for as YYYY-MM-DD (default: tomorrow in UTC)'),
+    )
+
+    def handle(self, *args, **options):
+        from api.views import total_population_today_and_tomorrow
+
+        try:
+            day = str_to_date('date', options['date']) if options['date'] else datetime.utcnow().date() + timedelta(days=1)
+        except ValueError:
+            raise CommandError('Invalid date %s, expected YYYY-MM-DD' % options['date'])
+        if day < datetime.utcnow().date():
+            raise CommandError('The day %s is already over' % day.isoformat())
+
+        if settings.CACHES[settings.RESPONSE_CACHE_ALIAS]['BACKEND'].endswith('LocMemCache'):
+            self.stderr.write('Warning: the response cache is an in-memory cache of this process, so the server processes will not see these responses.')
+
+        self.stdout.write('Calculating the total population responses for %s...' % day.isoformat())
+        start = time.time()
+        stored = 0
+        for country in dataStore.countries:
+            try:
+                data = total_population_today_and_tomorrow(country, day)
+            except ParseError as e:
+                self.stderr.write('Skipping %s: %s' % (country, e.detail))
+                continue
+            store_response_until_utc_eod('api.views.retrieve_total_population_now', {'country': country}, day, data)
+            stored += 1
+        self.stdout.write('Stored %i responses in %.02f seconds.' % (stored, time.time()-start))
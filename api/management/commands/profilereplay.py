@@ -0,0 +1,58 @@
+import time, cProfile
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import Client
+from api import benchmark
+from api.profiling import PROFILE_SORT_KEYS, formatStats
+
+
+class Command(BaseCommand):
+    args = '<request log>'
+    help = 'Replays the requests of a log in this process under cProfile and prints where the time was spent, by default in the functions of the api package'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', dest='repeat', type='int', default=1, help='How often to replay the log (default: 1)'),
+        make_option('--sort', dest='sort', type='choice', choices=list(PROFILE_SORT_KEYS), default='cumulative', help='Sort the functions by this column (default: cumulative)'),
+        make_option('--limit', dest='limit', type='int', default=40, help='The number of functions to print (default: 40)'),
+        make_option('--restrict', dest='restrict', default='api/', help='Only print the functions whose file or name matches this regular expression (default: api/, use "" for all)'),
+        make_option('--no-preload', dest='preload', action='store_false', default=True, help='Do not load all data before profiling, so that loading it is profiled as well'),
+        make_option('--output', dest='output', default=None, help='Save the profile into this file, to be read with pstats or e.g. snakeviz'),
+    )
+
+    def handle(self, *args, **options):
+        from api.algorithms import preload
+
+        if len(args) != 1:
+            raise CommandError('Please specify the request log to replay')
+        if options['repeat'] < 1:
+            raise CommandError('The log must be replayed at least once')
+        requests = list(benchmark.iterRequestLog(args[0]))
+        if not requests:
+            raise CommandError('The log %s does not contain any requests to the API' % args[0])
+
+        if options['preload']:
+            self.stdout.write('Loading all data...')
+            preload()
+
+        client = Client(HTTP_HOST=benchmark.clientHost())
+        profile = cProfile.Profile()
+        failures = 0
+        start = time.time()
+        for _ in range(options['repeat']):
+            for name, path, loggedStatus in requests:
+                profile.enable()
+                try:
+                    status = client.get(path).status_code
+                except Exception:   # the test client raises the errors which the server would answer with status 500
+                    status = 500
+                finally:
+                    profile.disable()
+                if status >= 400:
+                    failures += 1
+        duration = time.time() - start
+
+        count = len(requests) * options['repeat']
+        self.stdout.write('Replayed %i requests in %.02f seconds (%i failed).' % (count, duration, failures))
+        self.stdout.write(formatStats(profile, options['sort'], options['limit'], options['restrict'] or None))
+        if options['output']:
+            profile.dump_stats(options['output'])
+            self.stdout.write('Saved the profile into %s.' % options['output'])
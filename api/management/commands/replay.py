@@ -0,0 +1,60 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from api import benchmark, replay
+
+
+class Command(BaseCommand):
+    args = '<request log>'
+    help = 'Replays the requests of a log against this process or a running server, checks the responses and reports the throughput and the latencies per endpoint'
+    option_list = BaseCommand.option_list + (
+        make_option('--url', dest='url', default=None, help='Send the requests to the server at this URL, e.g. http://localhost:8000 (default: through the URLconf of this process)'),
+        make_option('--concurrency', dest='concurrency', type='int', default=1, help='The number of requests sent at the same time (default: 1)'),
+        make_option('--repeat', dest='repeat', type='int', default=1, help='How often to replay the log (default: 1)'),
+        make_option('--timeout', dest='timeout', type='float', default=60, help='The timeout of requests to a server in seconds (default: 60)'),
+        make_option('--no-preload', dest='preload', action='store_false', default=True, help='Do not load all data before replaying in this process'),
+        make_option('--output', dest='output', default=None, help='Store the results as JSON in this file'),
+        make_option('--fail-on-errors', dest='fail_on_errors', action='store_true', default=False, help='Fail if any response is wrong, e.g. for CI'),
+    )
+
+    def handle(self, *args, **options):
+        from api.algorithms import preload
+
+        if len(args) != 1:
+            raise CommandError('Please specify the request log to replay')
+        if options['concurrency'] < 1 or options['repeat'] < 1:
+            raise CommandError('The concurrency and repeat must be at least 1')
+        requests = list(benchmark.iterRequestLog(args[0])) * options['repeat']
+        if not requests:
+            raise CommandError('The log %s does not contain any requests to the API' % args[0])
+
+        if options['url']:
+            transport = replay.HttpTransport(options['url'], options['timeout'])
+            target = options['url']
+        else:
+            if options['preload']:
+                self.stdout.write('Loading all data...')
+                preload()
+            transport = replay.InProcessTransport(benchmark.clientHost())
+            target = 'this process'
+
+        self.stdout.write('Replaying %i requests against %s with %i concurrent requests...' % (len(requests), target, options['concurrency']))
+        results, duration = replay.replay(requests, transport, options['concurrency'])
+        summary = replay.summarize(results, duration)
+
+        for name, stats in summary.items():
+            self.stdout.write('%-42s %6i requests  %5i failed  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms' % (name, stats['requests'], stats['failures'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+        self.stdout.write('Replayed %i requests in %.02f seconds (%.1f requests per second).' % (len(results), duration, summary['all']['throughput_per_s']))
+        problems = [(path, problem) for name, path, latency, problem in results if problem]
+        for path, problem in problems[:10]:
+            self.stdout.write('Wrong response to %s: %s' % (path, problem))
+        if len(problems) > 10:
+            self.stdout.write('... and %i more wrong responses.' % (len(problems) - 10))
+
+        if options['output']:
+            document = benchmark.resultDocument(summary, log=args[0], url=options['url'], concurrency=options['concurrency'], repeat=options['repeat'])
+            with open(options['output'], 'w') as file:
+                json.dump(document, file, indent=2)
+            self.stdout.write('Stored the results in %s.' % options['output'])
+        if problems and options['fail_on_errors']:
+            raise CommandError('%i of %i responses were wrong' % (len(problems), len(results)))
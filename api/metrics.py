@@ -0,0 +1,111 @@
+import os, resource, threading
+from collections import defaultdict
+from api.timing import Histogram, HistogramSet, spanHistograms
+
+
+# the requests handled by this process, by view name and status code, and their durations in milliseconds by view name
+_requestCounts = defaultdict(int)
+_requestCountsLock = threading.Lock()
+requestHistograms = HistogramSet()
+
+
+def recordRequest(view, status, duration):
+    """ Counts a request to the view with the given name (or None for requests which no view answered) and records its duration. """
+    view = view or 'none'
+    with _requestCountsLock:
+        _requestCounts[(view, status)] += 1
+    requestHistograms.observe(view, duration)
+
+
+def _residentMemory():
+    """ Returns the current and the peak resident set size of this process in bytes (the current one is only available on Linux). """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        current = None
+    return current, peak
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, unicode(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in sorted(labels.items()))
+
+class _Exposition(object):
+    """ Collects metrics in the Prometheus text format, version 0.0.4. """
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help, samples):
+        """ Adds a metric with a list of (labels, value) samples. """
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            self.lines.append('%s%s %s' % (name, _formatLabels(labels), repr(float(value))))
+
+    def histograms(self, name, help, snapshots, label):
+        """ Adds a histogram in seconds from snapshots of timing.Histogram (in milliseconds) by the value of a label. """
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s histogram' % name)
+        for labelValue, snapshot in sorted(snapshots.items()):
+            labels = {label: labelValue} if label else {}
+            cumulative = 0
+            for bound, count in zip(snapshot['buckets'] + ['+Inf'], snapshot['counts']):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(bound / 1000.0)
+                self.lines.append('%s_bucket%s %i' % (name, _formatLabels(dict(labels, le=le)), cumulative))
+            self.lines.append('%s_sum%s %s' % (name, _formatLabels(labels), repr(snapshot['sum'] / 1000.0)))
+            self.lines.append('%s_count%s %i' % (name, _formatLabels(labels), snapshot['count']))
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def renderMetrics():
+    """
+    Returns the metrics of this process in the Prometheus text format: the requests and their durations by view, the durations of the
+    parts of the requests (see api.timing), the interpolation models, the result caches, the data store and the memory use. Nothing is
+    loaded for this, data which hasn't been loaded yet is left out.
+    """
+    from api.algorithms import rankCache, inverseTableCache, pop_day
+    from api.datastore import dataStore
+    from api.utils import is_loaded
+
+    exposition = _Exposition()
+    with _requestCountsLock:
+        counts = dict(_requestCounts)
+    exposition.metric('populationio_requests_total', 'counter', 'Requests handled by this process, by view and status code.',
+        [({'view': view, 'status': status}, count) for (view, status), count in sorted(counts.items())])
+    exposition.histograms('populationio_request_duration_seconds', 'Durations of the requests, by view.', requestHistograms.snapshot(), 'view')
+    exposition.histograms('populationio_span_duration_seconds', 'Time spent in the parts of the requests, see the Server-Timing header.', spanHistograms.snapshot(), 'span')
+
+    if is_loaded(pop_day):
+        buildDurations = Histogram()
+        for seconds in pop_day.build_durations.values():
+            buildDurations.observe(seconds * 1000)
+        exposition.metric('populationio_interpolation_models', 'gauge', 'Interpolation models built or loaded so far.',
+            [({}, sum(len(models) for models in pop_day.models.values()))])
+        exposition.histograms('populationio_interpolation_model_build_duration_seconds', 'Durations of building interpolation models on demand.',
+            {None: buildDurations.snapshot()}, None)
+
+    caches = [('rank', rankCache), ('inverse_table', inverseTableCache)]
+    if is_loaded(dataStore):
+        caches.append(('mortality', dataStore.mortality_distributions))
+    stats = [(name, cache.stats()) for name, cache in caches]
+    for key, kind, help in (('hits', 'counter', 'Hits of the result caches.'), ('misses', 'counter', 'Misses of the result caches.'),
+            ('evictions', 'counter', 'Evictions from the result caches.'), ('entries', 'gauge', 'Entries of the result caches.'),
+            ('bytes', 'gauge', 'Approximate size of the entries of the result caches.')):
+        exposition.metric('populationio_result_cache_%s%s' % (key, '_total' if kind == 'counter' else ''), kind, help, [({'cache': name}, values[key]) for name, values in stats])
+    exposition.metric('populationio_result_cache_hit_ratio', 'gauge', 'Share of the lookups of the result caches which were hits.',
+        [({'cache': name}, float(values['hits']) / (values['hits'] + values['misses'])) for name, values in stats if values['hits'] + values['misses']])
+
+    if is_loaded(dataStore):
+        exposition.metric('populationio_datastore_load_seconds', 'gauge', 'Time it took to read the data store CSVs.', [({}, dataStore.load_seconds)])
+
+    current, peak = _residentMemory()
+    if current is not None:
+        exposition.metric('process_resident_memory_bytes', 'gauge', 'Resident memory size of this process.', [({}, current)])
+    exposition.metric('process_max_resident_memory_bytes', 'gauge', 'Peak resident memory size of this process.', [({}, peak)])
+    return exposition.render()
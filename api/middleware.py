@@ -0,0 +1,77 @@
+import time
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from api import timing, metrics
+from api.profiling import PROFILE_SORT_KEYS, formatStats, saveStats, profileCall
+from api.utils import view_name
+
+
+class ServerTimingMiddleware(object):
+    """
+    Times every request and the spans of it (see api.timing), adds them to the response as a Server-Timing header (unless
+    settings.SERVER_TIMING_HEADER is disabled) and records them in timing.spanHistograms, and the request itself by view in api.metrics.
+    The time of rendering the response is measured as the render span. Should be the first middleware, so that the total covers the
+    other middlewares as well.
+    """
+
+    def process_request(self, request):
+        timing.startRequest()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = timing.currentTimer()
+        if timer is not None:
+            timer.view = view_name(view_func)
+
+    def process_template_response(self, request, response):
+        # this is called right before the response is rendered
+        timer = timing.currentTimer()
+        if timer is not None:
+            timer.renderStart = time.time()
+        return response
+
+    def process_response(self, request, response):
+        timer = timing.currentTimer()
+        if timer is not None and timer.renderStart is not None:
+            timer.add('render', time.time() - timer.renderStart)
+        timer = timing.finishRequest()
+        if timer is not None:
+            metrics.recordRequest(timer.view, response.status_code, timer.spans['total'])
+            if settings.SERVER_TIMING_HEADER:
+                response['Server-Timing'] = timer.header()
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a request with cProfile if it has the query parameter __profile=1 and an X-Profiling-Secret header which matches
+    settings.PROFILING_SECRET (profiling is disabled without that setting). Instead of the response, the statistics are returned as text,
+    sorted by __profile_sort (cumulative, tottime, ncalls or name) and limited to __profile_limit functions. If settings.PROFILING_PATH is
+    set, they are also saved there (see api.profiling.saveStats) and the path is returned in the X-Profile-Path header.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.PROFILING_SECRET or request.GET.get('__profile') != '1':
+            return None
+        if not constant_time_compare(request.META.get('HTTP_X_PROFILING_SECRET', ''), settings.PROFILING_SECRET):
+            return HttpResponse('Profiling needs the right X-Profiling-Secret header\n', status=403, content_type='text/plain')
+        sort = request.GET.get('__profile_sort', 'cumulative')
+        limit = request.GET.get('__profile_limit', '50')
+        if sort not in PROFILE_SORT_KEYS or not limit.isdigit():
+            return HttpResponse('__profile_sort must be one of %s and __profile_limit a number\n' % ', '.join(PROFILE_SORT_KEYS), status=400, content_type='text/plain')
+
+        def run():
+            # rendering (or streaming) the response is part of the work we want to see
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            elif response.streaming:
+                ''.join(response.streaming_content)
+            return response
+        response, profile = profileCall(run)
+
+        profiled = HttpResponse(formatStats(profile, sort, int(limit)), content_type='text/plain')
+        profiled['X-Profiled-Status'] = str(response.status_code)
+        if settings.PROFILING_PATH:
+            profiled['X-Profile-Path'] = saveStats(profile, settings.PROFILING_PATH, view_name(view_func) or 'request')
+        return profiled
@@ -3,14 +3,18 @@
 import datetime
 import time
 import os.path
-import cPickle as pickle
+import logging
 import numpy as np
-import csv
+import pandas as pd
 from collections import defaultdict
+from contextlib import contextmanager
 
 from scipy.interpolate import RectBivariateSpline
 
 
+logger = logging.getLogger(__name__)
+
+
 ###################################################################################################
 # Base Class
 ###################################################################################################
@@ -127,6 +131,15 @@ class PopulationModel(object):
         age = date - dob
         return self.pop_age(date, region, sex, age)
         
+    def pop_grid(self, region, sex):
+        '''
+        Return the population for the given region and sex for all ages and dates of the model as a
+        2D numpy array, with one row per age and one column per date. The array may be a view on
+        the model's own data, so it must not be modified.
+        This naive implementation may be overriden for efficiency.
+        '''
+        return np.array([[self.pop_age(date, region, sex, age) for date in self.dates()] for age in self.ages()], dtype=float)
+
     def pop_sum_age(self, date, region, sex, age_from = None, age_to = None):
         '''
         Return the population for the given parameters from age_from to age_to (inclusive).
@@ -155,9 +168,27 @@ class PopulationModel(object):
         multidob_pop = 0
         for dob in range(dob_from, dob_to+1):
             multidob_pop += self.pop_dob(date, region, sex, dob)
-        
+
         return multidob_pop
 
+    def pop_sum_age_array(self, dates, region, sex, ages_from = None, ages_to = None):
+        '''
+        Return an array of pop_sum_age() results, where dates, ages_from and ages_to may be arrays
+        (or scalars, which are broadcast against each other), all for the same region and sex.
+        This naive implementation may be overriden for efficiency.
+        '''
+        pop_sum_age = np.vectorize(lambda date, age_from, age_to: self.pop_sum_age(date, region, sex, age_from, age_to), otypes=[np.int64])
+        return pop_sum_age(dates, ages_from, ages_to)
+
+    def pop_sum_dob_array(self, dates, region, sex, dobs_from = None, dobs_to = None):
+        '''
+        Return an array of pop_sum_dob() results, where dates, dobs_from and dobs_to may be arrays
+        (or scalars, which are broadcast against each other), all for the same region and sex.
+        This naive implementation may be overriden for efficiency.
+        '''
+        pop_sum_dob = np.vectorize(lambda date, dob_from, dob_to: self.pop_sum_dob(date, region, sex, dob_from, dob_to), otypes=[np.int64])
+        return pop_sum_dob(dates, dobs_from, dobs_to)
+
     def pop_sum_dob_inverse_date(self, pop, region, sex, dob, date_from = None, date_to = None):
         '''
         Return the date on which a person born on dob would become the pop'th youngest
@@ -166,10 +197,19 @@ class PopulationModel(object):
         
         If you specify date_from or date_to it will constrain the search to that period.
         '''
-        date_lower = date_from or dob
-        date_upper = date_to or self.get_date_range()[1]
-        pop_lower = self.pop_sum_dob(date_lower, region, sex, dob, date_lower)
-        pop_upper = self.pop_sum_dob(date_upper, region, sex, dob, date_upper)
+        date_lower = date_from if date_from is not None else dob   # zero may be a valid value
+        date_upper = date_to if date_to is not None else self.get_date_range()[1]
+        return self._bisect_inverse_date(pop, region, sex, dob, date_lower, date_upper)
+
+    def _bisect_inverse_date(self, pop, region, sex, dob, date_lower, date_upper, pop_lower = None, pop_upper = None):
+        '''
+        The binary search of pop_sum_dob_inverse_date() between the given dates. The ranks on these
+        dates are calculated unless they are already known and passed in.
+        '''
+        if pop_lower is None:
+            pop_lower = self.pop_sum_dob(date_lower, region, sex, dob, date_lower)
+        if pop_upper is None:
+            pop_upper = self.pop_sum_dob(date_upper, region, sex, dob, date_upper)
         
         def midpoint(lower, upper):
             return lower + (upper - lower) / 2
@@ -206,44 +246,89 @@ class NpSingleYearPopulationModel(PopulationModel):
         '''Convert a date into an index into the numpy array'''
         return int(date)-self.date_range[0]
         
-    def __init__(self, filename, check_or_create_pickle = False):
+    def __init__(self, filename, check_or_create_cache = False, dtype = np.float64):
+        '''
+        The population figures are stored with the given numpy dtype, e.g. int32 halves the memory
+        needed compared to the default float64. A ValueError is raised if they don't fit into it.
+        '''
         self.age_range = (0, 100)
         self.date_range = (1950,2100)
         self.sexes = ('M','F', 'All')
+        self.dtype = np.dtype(dtype)
         self.arrays = None
-        if check_or_create_pickle and os.path.isfile(filename + ".pickle"):
-            with open(filename + ".pickle", "rb") as file:
-                self.arrays = pickle.load(file)
+        cube_filename, index_filename = "%s.%s.npy" % (filename, self.dtype.name), filename + ".regions"
+        if check_or_create_cache and os.path.isfile(cube_filename) and os.path.isfile(index_filename):
+            self._load_cube(cube_filename, index_filename)
         else:
             self._load_pop_csv(filename)
-            if check_or_create_pickle:
-                with open(filename + ".pickle", "wb") as file:
-                    pickle.dump(self.arrays, file)
-        
+            if check_or_create_cache:
+                self._save_cube(cube_filename, index_filename)
+
+    def _save_cube(self, cube_filename, index_filename):
+        '''
+        Save all arrays as one contiguous (region, sex, age, year) array into a .npy file, and the
+        order of the regions into a text file with one region per line. Both are written under
+        temporary names first, so that concurrently starting processes never read half a file.
+        '''
+        regions = sorted(self.arrays)
+        cube = np.array([[self.arrays[region][sex] for sex in self.sexes] for region in regions])
+        temp_suffix = ".%i.tmp" % os.getpid()
+        with open(index_filename + temp_suffix, "wb") as file:
+            file.write("".join(region + "\n" for region in regions))
+        with open(cube_filename + temp_suffix, "wb") as file:
+            np.save(file, cube)
+        os.rename(index_filename + temp_suffix, index_filename)
+        os.rename(cube_filename + temp_suffix, cube_filename)
 
-        self.arrays = dict(self.arrays)
+    def _load_cube(self, cube_filename, index_filename):
+        '''
+        Map the array saved by _save_cube() into memory (read-only), so that it is loaded lazily and
+        shared between all processes through the OS page cache. The arrays of the single regions
+        and sexes are views on it.
+        '''
+        with open(index_filename, "rb") as file:
+            regions = file.read().splitlines()
+        cube = np.asarray(np.load(cube_filename, mmap_mode="r"))
+        if cube.shape[:2] != (len(regions), len(self.sexes)):
+            raise ValueError("Dimension of population cache does not match", cube.shape, (len(regions), len(self.sexes)))
+        if cube.dtype != self.dtype:
+            raise ValueError("Type of population cache does not match", cube.dtype, self.dtype)
+        self.arrays = dict((region, dict((sex, cube[region_idx, sex_idx]) for sex_idx, sex in enumerate(self.sexes))) for region_idx, region in enumerate(regions))
 
     def _load_pop_csv(self, filename):
-        '''Load the CSV file into a dictionary-of-dictionaries of arrays for quick access.'''
-        self.arrays = defaultdict(lambda: defaultdict(lambda: np.empty((self.age_range[1]-self.age_range[0]+1, self.date_range[1]-self.date_range[0]+1))))
+        '''
+        Load the CSV file into a dictionary-of-dictionaries of arrays for quick access. The file
+        is parsed in one go by pandas, and all values are then scattered into a single (region,
+        sex, age, year) array with numpy fancy indexing, of which the arrays are views.
+        '''
+        start = time.time()
+        # ?, LocID, Location (Country), VarID, Variant, Time, Age, pop male, pop female, pop total
+        data = pd.read_csv(filename, usecols=['Location', 'Time', 'Age', 'PopMale', 'PopFemale', 'PopTotal'],
+            dtype={'Location': str, 'Time': np.int64, 'Age': np.int64, 'PopMale': np.float64, 'PopFemale': np.float64, 'PopTotal': np.float64},
+            float_precision='round_trip')
 
-        with open(filename, 'r') as file:
-            reader = csv.DictReader(file)
-            # ?, LocID, Location (Country), VarID, Variant, Time, Age, pop male, pop female, pop total
+        region_codes, regions = pd.factorize(data['Location'], sort=True)
+        age_idx = data['Age'].values - self.age_range[0]
+        date_idx = data['Time'].values - self.date_range[0]
+        cube = np.zeros((len(regions), len(self.sexes), self.age_range[1]-self.age_range[0]+1, self.date_range[1]-self.date_range[0]+1))
+        for sex_idx, column in enumerate(('PopMale', 'PopFemale', 'PopTotal')):
+            # the values are in thousands, and are rounded to whole persons (half up, like round())
+            cube[region_codes, sex_idx, age_idx, date_idx] = np.floor(data[column].values * 1000 + 0.5)
 
-            for row in reader:
-                loc_dict = self.arrays[row['Location']]
-                loc_dict['M'][self._age_index(row['Age']), self._date_index(row['Time'])] = round(float(row['PopMale'])*1000)
-                loc_dict['F'][self._age_index(row['Age']),self._date_index(row['Time'])] = round(float(row['PopFemale'])*1000)
-                loc_dict['All'][self._age_index(row['Age']),self._date_index(row['Time'])] = round(float(row['PopTotal'])*1000)
+        if cube.dtype != self.dtype:
+            converted = cube.astype(self.dtype)
+            if not np.array_equal(converted, cube):
+                # find an example of a value which has overflown or lost precision
+                index = np.unravel_index(np.argmax(converted != cube), cube.shape)
+                raise ValueError("Population value does not fit into dtype", cube[index], self.dtype.name)
+            cube = converted
 
-        for loc in self.arrays:
-            self.arrays[loc] = dict(self.arrays[loc])
+        self.arrays = dict((region, dict((sex, cube[region_idx, sex_idx]) for sex_idx, sex in enumerate(self.sexes))) for region_idx, region in enumerate(regions))
+        duration = time.time() - start
+        logger.info('Parsed %i rows of population data in %.02f seconds (%i rows per second)', len(data), duration, len(data) / max(duration, 1e-6))
 
-        self.arrays = dict(self.arrays)
-        
     def get_regions(self):
-        return self.arrays.keys()
+        return sorted(self.arrays)
         
     def get_age_range(self):
         return self.age_range
@@ -262,6 +347,12 @@ class NpSingleYearPopulationModel(PopulationModel):
             return 0 # Return 0 for outside-range ages, since this model is intended to be complete
         
         return int(self.arrays[region][sex][self._age_index(age),self._date_index(date)])
+
+    def pop_grid(self, region, sex):
+        # a read-only view, which avoids copying the array
+        grid = self.arrays[region][sex].view()
+        grid.flags.writeable = False
+        return grid
         
 
 ###################################################################################################
@@ -314,6 +405,95 @@ def decimal_year_to_days(year, frac, start_month=1, start_day=1):
     days = year_start_days + frac * year_length
     return days
 
+def bspline_integrals(t, k, x_from, x_to):
+    '''
+    Returns the integrals of all normalized B-splines of degree k on the knots t from x_from to
+    x_to, for whole arrays of integration bounds at once (one row per pair of bounds). This is a
+    vectorized port of FITPACK's fpintb, which is what RectBivariateSpline.integral() uses
+    internally, using the formulae of Gaffney for the indefinite integrals of B-splines.
+    '''
+    k1 = k + 1
+    nk1 = len(t) - k1
+    x_from = np.asarray(x_from, dtype=float)
+    x_to = np.asarray(x_to, dtype=float)
+    rows = np.arange(len(x_from))
+
+    # arrange the bounds in increasing order and clip them to the knot range
+    reverse = x_from > x_to
+    a = np.maximum(np.where(reverse, x_to, x_from), t[k1-1])
+    b = np.minimum(np.where(reverse, x_from, x_to), t[nk1])
+
+    def indefinite_integrals(arg):
+        # find the knot interval t[l] <= arg < t[l+1], then calculate the indefinite integrals of
+        # the k1 B-splines which are non-zero at arg
+        l = np.clip(np.searchsorted(t, arg, side='right'), k1, nk1) - 1
+        knots = t[l[:, np.newaxis] + np.arange(-k, k1 + 1)].T   # knots[k+i] is t[l+i]
+        aint = [(arg - knots[k]) / (knots[k+1] - knots[k])] + [0] * k
+        h = [0] * (k1 + 1)
+        h1 = [1] + [0] * k1
+        for j in range(1, k1):
+            h[0] = 0
+            for i in range(1, j+1):
+                f = h1[i-1] / (knots[k+i] - knots[k+i-j])
+                h[i-1] = h[i-1] + f * (knots[k+i] - arg)
+                h[i] = f * (arg - knots[k+i-j])
+            for i in range(1, j+2):
+                aint[i-1] = aint[i-1] + h[i-1] * (arg - knots[k+i-j-1]) / (knots[k+i] - knots[k+i-j-1])
+                h1[i-1] = h[i-1]
+        return l - k, aint
+
+    start_a, aint_a = indefinite_integrals(a)
+    start_b, aint_b = indefinite_integrals(b)
+    bint = np.zeros((len(a), nk1))
+    for i in range(k1):
+        bint[rows, start_a + i] = -aint_a[i]
+    for i in range(k1):
+        bint[rows, start_b + i] += aint_b[i]
+    # the B-splines in between the two intervals are integrated over their whole support
+    columns = np.arange(nk1)
+    bint += (columns >= start_a[:, np.newaxis]) & (columns < start_b[:, np.newaxis])
+    bint *= (t[k1:] - t[:nk1]) / float(k1)
+
+    bint[a >= b] = 0
+    bint[reverse] *= -1
+    return bint
+
+def rect_spline_integrals(spline, x_from, x_to, y_from, y_to, chunk_size = 4096):
+    '''
+    A vectorized version of RectBivariateSpline.integral(), which integrates the spline over a
+    whole array of rectangles at once. The results agree with integral() up to floating point
+    rounding errors. This is only efficient for rectangles which are narrow in y, i.e. which
+    only span a few knots in that dimension.
+    '''
+    tx, ty, c = spline.tck
+    kx, ky = spline.degrees
+    coeffs = c.reshape(len(tx) - kx - 1, len(ty) - ky - 1)
+
+    integrals = np.empty(len(x_from))
+    for start in range(0, len(x_from), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        wx = bspline_integrals(tx, kx, x_from[chunk], x_to[chunk])
+        wy = bspline_integrals(ty, ky, y_from[chunk], y_to[chunk])
+
+        # Only a few B-splines in y are non-zero for each rectangle, so we group the rectangles by
+        # the first of them and only multiply with the corresponding columns of coefficients. If
+        # the groups are very small, one multiplication with all coefficients is quicker though.
+        nonzero = wy != 0
+        first = nonzero.argmax(axis=1)
+        last = np.where(nonzero.any(axis=1), wy.shape[1] - nonzero[:, ::-1].argmax(axis=1), first)
+        y_indices = np.unique(first)
+        if len(y_indices) * 16 > len(wy):
+            integrals[chunk] = (wx.dot(coeffs) * wy).sum(axis=1)
+            continue
+        chunk_integrals = np.zeros(len(wy))
+        for y_index in y_indices:
+            rows = np.nonzero(first == y_index)[0]
+            y_columns = slice(y_index, last[rows].max())
+            chunk_integrals[rows] = (wx[rows].dot(coeffs[:, y_columns]) * wy[rows, y_columns]).sum(axis=1)
+        integrals[chunk] = chunk_integrals
+
+    return integrals
+
 class DailyPopulationModel(PopulationModel):
     '''
     Another abstract class for building daily population models that build upon and interpolate
@@ -358,14 +538,33 @@ class DailyPopulationModel(PopulationModel):
         age_frac = age_years_float - age_years
         return age_years, age_frac
 
+@contextmanager
+def no_span(name):
+    '''The default span function of BicubicSplineDailyPopulationModel, which does nothing.'''
+    yield
+
 class BicubicSplineDailyPopulationModel(DailyPopulationModel): 
     '''
     An implementation of a daily population model that uses bicubic (ie. two dimensional) splines
     to interpolate both over age and over enumeration date.
     '''           
-    def __init__(self, base_model, enum_month = 7, enum_day = 1):
+    INVERSE_TABLE_LEVELS = 7        # number of binary search steps precomputed by pop_sum_dob_inverse_date()
+
+    def __init__(self, base_model, enum_month = 7, enum_day = 1, span = None, inverse_table_cache = None):
+        '''
+        If a span function is given, it is called with the name of the part of a calculation that
+        starts, 'model' for getting (or building) an interpolation model and 'integrate' for
+        integrating it, and must return a context manager which ends it, e.g. to time these parts.
+
+        The tables of get_inverse_table() are kept in the inverse_table_cache if one is given. It
+        must have a getOrCompute(key, compute) method, which is safe to call from several threads,
+        like api.lrucache.LRUCache.
+        '''
         super(BicubicSplineDailyPopulationModel, self).__init__(base_model, enum_month, enum_day)
         self.models = defaultdict(lambda: dict())
+        self.inverse_table_cache = inverse_table_cache
+        self.build_durations = {}   # the seconds it took to build the models built on demand, by (region, sex)
+        self.span = span if span is not None else no_span
     
     def get_model(self, region, sex):
         '''
@@ -373,16 +572,91 @@ class BicubicSplineDailyPopulationModel(DailyPopulationModel):
         model. Call build_all_models() to force precomputation of all interpolations, which will
         save time when calls are made later.
         '''
-        try:
-            return self.models[region][sex]
-        except KeyError:
-            self.models[region][sex] = self.build_model(region, sex)
-            return self.models[region][sex]
+        with self.span('model'):
+            try:
+                return self.models[region][sex]
+            except KeyError:
+                start = time.time()
+                self.models[region][sex] = self.build_model(region, sex)
+                self.build_durations[(region, sex)] = time.time() - start
+                return self.models[region][sex]
             
-    def build_all_models(self):
+    def build_all_models(self, filename = None):
+        '''
+        Build the interpolation models for all regions and sexes. If a filename is given and the
+        file exists, the models are loaded from there instead, otherwise they are saved to it after
+        building them, see save_models(). A file saved from different population data is ignored
+        and overwritten.
+        '''
+        if filename is not None and os.path.isfile(filename):
+            if self.load_models(filename):
+                return
+            logger.warning('The interpolation models in %s do not match the population data, rebuilding them', filename)
+
         for region in self.get_regions():
             for sex in self.get_sexes():
                 self.get_model(region, sex)
+
+        if filename is not None:
+            self.save_models(filename)
+
+    def source_fingerprint(self):
+        '''
+        Describe the population data that the models are built from: the regions, the age and date
+        ranges, the enumeration day and the sum of every grid, which changes with (almost) any
+        update of the data.
+        '''
+        regions = sorted(self.get_regions())
+        return dict(
+            source_regions = regions,
+            source_ranges = list(self.base_model.get_age_range()) + list(self.base_model.get_date_range()) + [self.enum_month, self.enum_day],
+            source_totals = [[float(self.base_model.pop_grid(region, sex).sum()) for sex in self.get_sexes()] for region in regions])
+
+    def save_models(self, filename):
+        '''
+        Save the knots and coefficients of all interpolation models built so far into a single
+        (uncompressed) numpy .npz file, which load_models() can read back much quicker than the
+        models can be built, together with a fingerprint of the population data. The file is
+        written under a temporary name first, so that concurrently starting processes never read
+        half a file.
+        '''
+        keys = [(region, sex) for region in sorted(self.models) for sex in sorted(self.models[region])]
+        models = [self.models[region][sex] for region, sex in keys]
+        temp_filename = "%s.%i.tmp" % (filename, os.getpid())
+        with open(temp_filename, "wb") as file:
+            np.savez(file,
+                regions = [region for region, sex in keys],
+                sexes = [sex for region, sex in keys],
+                degrees = [model.degrees for model in models],
+                fp = [model.fp for model in models],
+                tx = [model.tck[0] for model in models],
+                ty = [model.tck[1] for model in models],
+                c = [model.tck[2] for model in models],
+                **self.source_fingerprint())
+        os.rename(temp_filename, filename)
+
+    def load_models(self, filename):
+        '''
+        Load the interpolation models saved by save_models(), replacing any that have been built.
+        Nothing is loaded if they were built from different population data (or by an older
+        version without a fingerprint), and False is returned.
+        '''
+        data = np.load(filename)
+        try:
+            fingerprint = self.source_fingerprint()
+            for key, value in fingerprint.items():
+                if key not in data.files or data[key].tolist() != value:
+                    return False
+            for region, sex, degrees, fp, tx, ty, c in zip(data['regions'].tolist(), data['sexes'].tolist(), data['degrees'].tolist(), data['fp'], data['tx'], data['ty'], data['c']):
+                # the fitting only happens in the constructor, so we skip it and just set the result
+                model = RectBivariateSpline.__new__(RectBivariateSpline)
+                model.tck = (tx, ty, c)
+                model.degrees = tuple(degrees)
+                model.fp = fp
+                self.models[region][sex] = model
+        finally:
+            data.close()
+        return True
             
     def build_model(self, region, sex):
         '''
@@ -391,10 +665,7 @@ class BicubicSplineDailyPopulationModel(DailyPopulationModel):
         '''
         min_b_age, max_b_age = self.base_model.get_age_range()
         min_b_date, max_b_date = self.base_model.get_date_range()
-        pop = np.empty((max_b_age - min_b_age + 1, max_b_date - min_b_date + 1))
-        for age_idx in range(0, max_b_age - min_b_age + 1):
-            for date_idx in range(0, max_b_date - min_b_date + 1):
-                pop[age_idx, date_idx] = self.base_model.pop_age(min_b_date + date_idx, region, sex, min_b_age + age_idx)
+        pop = self.base_model.pop_grid(region, sex)
                 
         # Since we're disaggregating here, we need to take people born throughout a year and impute
         # the number born on a given day. We assume even distribution across all days of a typical
@@ -438,23 +709,228 @@ class BicubicSplineDailyPopulationModel(DailyPopulationModel):
         age_to = self.check_age(age_to, "max", truncate=True)
     
         model = self.get_model(region, sex)
-        
+        return self._integrate_ages(model, date, age_from, age_to)
+
+    def _integrate_ages(self, model, date, age_from, age_to):
+        '''
+        Integrate the interpolation model over the (already checked) age range on the given date.
+        '''
         # Never want to access the function outside the interpolation points, so
         # for the edge case we adjust our integration bounds to avoid edge effects.
-        if date - 0.1 < self.get_date_range()[0]:
-            pop_sum = model.integral(age_from, age_to+1, date, date + 0.1)*10
-        elif date + 0.1 > self.get_date_range()[1]:
-            pop_sum = model.integral(age_from, age_to+1, date - 0.1, date)*10
-        else:
-            pop_sum = model.integral(age_from, age_to+1, date - 0.1, date + 0.1)*5
-                
+        with self.span('integrate'):
+            if date - 0.1 < self.get_date_range()[0]:
+                pop_sum = model.integral(age_from, age_to+1, date, date + 0.1)*10
+            elif date + 0.1 > self.get_date_range()[1]:
+                pop_sum = model.integral(age_from, age_to+1, date - 0.1, date)*10
+            else:
+                pop_sum = model.integral(age_from, age_to+1, date - 0.1, date + 0.1)*5
+
         return int(round(pop_sum))
-        
+
+    def get_inverse_table(self, region, sex, dob, date_from, date_to):
+        '''
+        Get a table of the ranks of a person born on dob on all the dates that the first
+        INVERSE_TABLE_LEVELS steps of the binary search between date_from and date_to may visit, as
+        a dict from dates to ranks. The ranks are calculated in one go with pop_sum_dob_array(), and
+        the tables are cached in the inverse_table_cache, if any.
+        '''
+        if self.inverse_table_cache is None:
+            return self._build_inverse_table(region, sex, dob, date_from, date_to)
+        return self.inverse_table_cache.getOrCompute((region, sex, dob, date_from, date_to),
+            lambda: self._build_inverse_table(region, sex, dob, date_from, date_to))
+
+    def _build_inverse_table(self, region, sex, dob, date_from, date_to):
+        dates = set([date_from, date_to])
+        brackets = [(date_from, date_to)]
+        for level in range(self.INVERSE_TABLE_LEVELS):
+            next_brackets = []
+            for date_lower, date_upper in brackets:
+                if date_upper - date_lower > 1:
+                    date_midpoint = date_lower + (date_upper - date_lower) / 2
+                    dates.add(date_midpoint)
+                    next_brackets += [(date_lower, date_midpoint), (date_midpoint, date_upper)]
+            brackets = next_brackets
+        dates = sorted(dates)
+        return dict(zip(dates, self.pop_sum_dob_array(dates, region, sex, dob, dates).tolist()))
+
+    def pop_sum_dob_inverse_date(self, pop, region, sex, dob, date_from = None, date_to = None):
+        '''
+        Does the same binary search as the base class, but takes its first steps on a precomputed
+        table, see get_inverse_table(). The bracket that is left over is then narrowed down by
+        linear interpolation, which is usually accurate to a day, so that only a couple of calls of
+        pop_sum_dob() remain. The result is identical to the plain binary search as long as the
+        rank only passes pop once within that last bracket.
+        '''
+        date_lower = date_from if date_from is not None else dob   # zero may be a valid value
+        date_upper = date_to if date_to is not None else self.get_date_range()[1]
+        table = self.get_inverse_table(region, sex, dob, date_lower, date_upper)
+        pop_lower, pop_upper = table[date_lower], table[date_upper]
+
+        date_midpoint = date_lower + (date_upper - date_lower) / 2
+        while date_upper - date_lower > 1 and date_midpoint in table:
+            if table[date_midpoint] < pop:
+                date_lower, pop_lower = date_midpoint, table[date_midpoint]
+            else:
+                date_upper, pop_upper = date_midpoint, table[date_midpoint]
+            date_midpoint = date_lower + (date_upper - date_lower) / 2
+
+        if pop_lower < pop <= pop_upper:
+            # narrow down the bracket with an interpolated guess and its neighbour towards the date
+            guess = date_lower + int((pop - pop_lower) * (date_upper - date_lower) / float(pop_upper - pop_lower))
+            for date in (guess, guess + 1, guess - 1):
+                if date_upper - date_lower <= 1:
+                    break
+                if date_lower < date < date_upper:
+                    pop_date = self.pop_sum_dob(date, region, sex, dob, date)
+                    if pop_date < pop:
+                        date_lower, pop_lower = date, pop_date
+                    else:
+                        date_upper, pop_upper = date, pop_date
+
+        return self._bisect_inverse_date(pop, region, sex, dob, date_lower, date_upper, pop_lower, pop_upper)
+
     def pop_sum_dob(self, date, region, sex, dob_from = None, dob_to = None):
         age_from = date - dob_to if dob_to is not None else None
         age_to = date - dob_from if dob_from is not None else None
         return self.pop_sum_age(date, region, sex, age_from, age_to)
-        
+
+    def pop_sum_age_array(self, dates, region, sex, ages_from = None, ages_to = None):
+        min_date, max_date = self.get_date_range()
+        min_age, max_age = self.get_age_range()
+        dates = np.asarray(dates)
+        if dates.size and (dates.min() < min_date or dates.max() > max_date):
+            raise ValueError("Date outside valid range", dates.min() if dates.min() < min_date else dates.max(), (min_date, max_date))
+        ages_from = np.clip(ages_from, min_age, max_age) if ages_from is not None else min_age
+        ages_to = np.clip(ages_to, min_age, max_age) if ages_to is not None else max_age
+        dates, ages_from, ages_to = np.broadcast_arrays(dates, ages_from, ages_to)
+        shape = dates.shape
+        dates, ages_from, ages_to = dates.ravel(), ages_from.ravel(), ages_to.ravel()
+
+        # the same integration bounds as in _integrate_ages(), for all dates at once
+        at_min_date = dates - 0.1 < min_date
+        at_max_date = ~at_min_date & (dates + 0.1 > max_date)
+        dates_from = np.where(at_min_date, dates, dates - 0.1)
+        dates_to = np.where(at_max_date, dates, dates + 0.1)
+        scale = np.where(at_min_date | at_max_date, 10, 5)
+
+        model = self.get_model(region, sex)
+        with self.span('integrate'):
+            pop_sums = rect_spline_integrals(model, ages_from, ages_to + 1, dates_from, dates_to) * scale
+        results = np.where(pop_sums < 0, -np.floor(0.5 - pop_sums), np.floor(pop_sums + 0.5)).astype(np.int64)
+
+        # The integrals are only equal to those of pop_sum_age() up to floating point errors, so the
+        # few sums which are very close to a rounding boundary are recalculated one by one to
+        # guarantee exactly the same results.
+        boundary_distance = np.abs(pop_sums - np.floor(pop_sums) - 0.5)
+        for i in np.nonzero(boundary_distance <= 1e-13 * np.abs(pop_sums) + 1e-9)[0]:
+            results[i] = self._integrate_ages(model, dates[i], ages_from[i], ages_to[i])
+
+        return results.reshape(shape)
+
+    def pop_sum_dob_array(self, dates, region, sex, dobs_from = None, dobs_to = None):
+        ages_from = np.subtract(dates, dobs_to) if dobs_to is not None else None
+        ages_to = np.subtract(dates, dobs_from) if dobs_from is not None else None
+        return self.pop_sum_age_array(dates, region, sex, ages_from, ages_to)
+
+
+###################################################################################################
+# Daily Totals Table
+###################################################################################################
+
+class PopulationTotalsTable(object):
+    '''
+    A dense table of the total population of one sex (over the full age range) of every region on
+    every day in a date range, as calculated by pop_sum_age() of a daily population model. It is
+    built once with build() and then answers these sums by lookup, see get().
+    '''
+
+    def __init__(self, regions, sex, date_from, totals, source = None):
+        '''
+        The source is the fingerprint of the population data of the model which the table was
+        built from, see is_built_from().
+        '''
+        self.regions = list(regions)
+        self.sex = sex
+        self.date_from = date_from
+        self.totals = totals
+        self.source = source
+        self.filename = None   # the file which the table has been loaded from, if any
+        if self.regions != sorted(set(self.regions)):
+            raise ValueError("Regions of the table are not sorted and unique")
+        self.region_indices = dict((region, index) for index, region in enumerate(self.regions))
+
+    @classmethod
+    def build(cls, model, sex, date_from, date_to):
+        '''
+        Calculate the totals of all regions of the given model on all days from date_from to
+        date_to (inclusive).
+        '''
+        regions = sorted(model.get_regions())
+        dates = np.arange(date_from, date_to + 1)
+        totals = np.empty((len(regions), len(dates)), dtype=np.int64)
+        for index, region in enumerate(regions):
+            totals[index] = model.pop_sum_age_array(dates, region, sex)
+        return cls(regions, sex, date_from, totals, model.source_fingerprint())
+
+    def get_date_range(self):
+        return (self.date_from, self.date_from + self.totals.shape[1] - 1)
+
+    def get(self, date, region):
+        '''
+        Return the total population of the region on the given date. Raises a KeyError for unknown
+        regions and a ValueError for dates outside the table.
+        '''
+        min_date, max_date = self.get_date_range()
+        if date < min_date or date > max_date:
+            raise ValueError("Date outside valid range", date, (min_date, max_date))
+        return int(self.totals[self.region_indices[region], date - self.date_from])
+
+    def save(self, filename):
+        '''
+        Save the table into an (uncompressed) numpy .npz file, which load() can read back. Like
+        save_models(), it is written under a temporary name first.
+        '''
+        temp_filename = "%s.%i.tmp" % (filename, os.getpid())
+        with open(temp_filename, "wb") as file:
+            np.savez(file, regions = self.regions, sex = self.sex, date_from = self.date_from, totals = self.totals, **(self.source or {}))
+        os.rename(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        try:
+            source = dict((key, data[key].tolist()) for key in data.files if key.startswith('source_')) or None
+            table = cls(data['regions'].tolist(), data['sex'].tolist(), int(data['date_from']), data['totals'], source)
+            table.filename = filename
+            return table
+        finally:
+            data.close()
+
+    def is_built_from(self, model):
+        '''
+        Whether the table was built from the same population data as the given daily model uses,
+        see BicubicSplineDailyPopulationModel.source_fingerprint(). Tables saved without a
+        fingerprint never are.
+        '''
+        return self.source == model.source_fingerprint()
+
+    def check(self, model, samples = 1000, seed = 0):
+        '''
+        Compare randomly sampled totals with pop_sum_age() of the given model, and return a list of
+        (region, date, table total, model total) for all that differ.
+        '''
+        random = np.random.RandomState(seed)
+        min_date, max_date = self.get_date_range()
+        mismatches = []
+        for _ in range(samples):
+            region = self.regions[random.randint(len(self.regions))]
+            date = random.randint(min_date, max_date + 1)
+            total, expected = self.get(date, region), model.pop_sum_age(date, region, self.sex)
+            if total != expected:
+                mismatches.append((region, date, total, expected))
+        return mismatches
+
+
 
 
 
@@ -0,0 +1,29 @@
+import os, io, time, pstats, cProfile
+
+
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'name')
+
+
+def formatStats(profile, sort='cumulative', limit=50, restriction=None):
+    """ Returns the statistics of a cProfile.Profile as text, sorted by the given key and limited to the given number of functions, and
+        optionally to those whose file or name matches the restriction (a regular expression).
+    """
+    output = io.BytesIO()
+    stats = pstats.Stats(profile, stream=output)
+    stats.sort_stats(sort)
+    stats.print_stats(*[restriction, limit] if restriction else [limit])
+    return output.getvalue()
+
+def saveStats(profile, directory, name):
+    """ Saves the statistics of a cProfile.Profile into a file in the directory, which can be read with pstats or e.g. snakeviz, and
+        returns its path.
+    """
+    path = os.path.join(directory, '%s-%s-%i.prof' % (name, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+    profile.dump_stats(path)
+    return path
+
+def profileCall(function, *args, **kwargs):
+    """ Calls the function under cProfile and returns its result and the cProfile.Profile. """
+    profile = cProfile.Profile()
+    result = profile.runcall(function, *args, **kwargs)
+    return result, profile
@@ -0,0 +1,56 @@
+import re
+
+
+# alternative spellings of region names, which lookup() maps to the names used in the dataset (if these are part of the registry)
+REGION_ALIASES = {
+    'uk': 'United Kingdom',
+    'great britain': 'United Kingdom',
+    'usa': 'United States of America',
+    'us': 'United States of America',
+    'united states': 'United States of America',
+    'russia': 'Russian Federation',
+    'south korea': 'Republic of Korea',
+    'north korea': "Dem. People's Republic of Korea",
+    'vietnam': 'Viet Nam',
+    'iran': 'Iran (Islamic Republic of)',
+    'syria': 'Syrian Arab Republic',
+    'bolivia': 'Bolivia (Plurinational State of)',
+    'venezuela': 'Venezuela (Bolivarian Republic of)',
+    'tanzania': 'United Republic of Tanzania',
+    'laos': "Lao People's Democratic Republic",
+    'moldova': 'Republic of Moldova',
+}
+
+
+def normalizeRegionName(name):
+    """ Returns the form of a region name which lookup() compares: lower case, with underscores as spaces (like in the table filenames)
+        and runs of whitespace collapsed.
+    """
+    return re.sub(r'\s+', ' ', name.replace('_', ' ')).strip().lower()
+
+
+class RegionRegistry(object):
+    """ The set of valid names of a kind of region (countries or continents), in sorted order. Membership tests are constant time and
+        match names exactly, lookup() also finds the name for differently cased or aliased input.
+    """
+
+    def __init__(self, names, aliases=REGION_ALIASES):
+        self.names = tuple(sorted(set(names)))
+        self._nameSet = frozenset(self.names)
+        self._normalized = dict((normalizeRegionName(alias), name) for alias, name in aliases.items() if name in self._nameSet)
+        self._normalized.update((normalizeRegionName(name), name) for name in self.names)
+
+    def __contains__(self, name):
+        return name in self._nameSet
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name):
+        """ Returns the name of the region which the given name refers to, ignoring case and accepting aliases, or None. """
+        if name in self._nameSet:
+            return name
+        return self._normalized.get(normalizeRegionName(name))
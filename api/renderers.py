@@ -0,0 +1,73 @@
+import csv
+import io
+from collections import OrderedDict
+import numpy as np
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def to_columns(data):
+    """
+    Returns the data of a response as a list of (name, values) columns. Tables are passed as dicts from column names to equally long lists
+    or arrays (ordered dicts keep their column order), anything else (e.g. an error message) becomes a table of a single row.
+    """
+    if isinstance(data, dict) and data and all(isinstance(values, (list, tuple, np.ndarray)) for values in data.values()):
+        return data.items()
+    if isinstance(data, dict):
+        return [(name, [value]) for name, value in sorted(data.items())]
+    return [('value', [data])]
+
+
+class TableRenderer(BaseRenderer):
+    """
+    Base class of the renderers for bulk tables, which are selected with the format query parameter or the Accept header. Views which
+    return tables check for these renderers and pass their table as columns instead of rows, see to_columns().
+    """
+    pass
+
+
+class ColumnarJSONRenderer(TableRenderer):
+    """
+    Renders a table as a JSON object of one array per column, which is much more compact than an array of one object per row.
+    """
+    media_type = 'application/vnd.population-io.columns+json'
+    format = 'columns'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        columns = OrderedDict((name, values.tolist() if isinstance(values, np.ndarray) else list(values)) for name, values in to_columns(data))
+        return JSONRenderer().render(columns, 'application/json', renderer_context)
+
+
+class CSVRenderer(TableRenderer):
+    """
+    Renders a table as CSV with a header row.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        columns = to_columns(data)
+        output = io.BytesIO()
+        writer = csv.writer(output)
+        writer.writerow([name for name, values in columns])
+        for row in zip(*[values.tolist() if isinstance(values, np.ndarray) else values for name, values in columns]):
+            writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value for value in row])
+        return output.getvalue()
+
+
+class NumpyRenderer(TableRenderer):
+    """
+    Renders a table as a NumPy .npy file of a structured array, with one field per column. Load it with numpy.load().
+    """
+    media_type = 'application/x-npy'
+    format = 'npy'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        columns = to_columns(data)
+        table = np.rec.fromarrays([np.asarray(values) for name, values in columns], names=[str(name) for name, values in columns])
+        output = io.BytesIO()
+        np.lib.format.write_array(output, np.asarray(table))
+        return output.getvalue()
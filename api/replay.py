@@ -0,0 +1,141 @@
+import json, time, socket, urllib2, threading
+from collections import OrderedDict
+import numpy as np
+from django.test.client import Client
+
+
+# the keys which the JSON object of a successful response of each view must contain, or list for the views which respond with arrays
+RESPONSE_SHAPES = {
+    'list_countries': ['countries'],
+    'world_population_rank_today': ['rank', 'dob', 'sex', 'country'],
+    'world_population_rank_by_date': ['rank', 'dob', 'sex', 'country', 'date'],
+    'world_population_rank_by_age': ['rank', 'dob', 'sex', 'country', 'age'],
+    'world_population_rank_in_past': ['rank', 'dob', 'sex', 'country', 'offset'],
+    'world_population_rank_in_future': ['rank', 'dob', 'sex', 'country', 'offset'],
+    'date_by_world_population_rank': ['dob', 'sex', 'country', 'rank', 'date_on_rank'],
+    'calculate_remaining_life_expectancy': ['date', 'sex', 'country', 'age', 'remaining_life_expectancy'],
+    'calculate_remaining_life_expectancy_curve': ['date', 'sex', 'country', 'remaining_life_expectancies'],
+    'total_life_expectancy': ['dob', 'sex', 'country', 'total_life_expectancy'],
+    'retrieve_population_table': list,
+    'retrieve_total_population': ['total_population'],
+    'retrieve_total_population_now': ['total_population'],
+    'calculate_mortality_distribution': ['mortality_distribution'],
+    'status': ['ready', 'loaded'],
+}
+
+
+def checkResponse(name, status, contentType, content, expectedStatus=None):
+    """ Returns what is wrong with a response to a request to the view with the given name, or None if it's fine: its status must be
+        the expected one (or any below 400 if none is expected), and the JSON of a successful response must have the shape of the view's
+        responses (see RESPONSE_SHAPES).
+    """
+    if expectedStatus is not None and status != expectedStatus:
+        return 'status %i instead of %i' % (status, expectedStatus)
+    if expectedStatus is None and status >= 400:
+        return 'status %i' % status
+    if status != 200 or name not in RESPONSE_SHAPES or not contentType.startswith('application/json'):
+        return None
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return 'invalid JSON'
+    shape = RESPONSE_SHAPES[name]
+    if shape is list:
+        return None if isinstance(data, list) else 'not a JSON array'
+    if not isinstance(data, dict):
+        return 'not a JSON object'
+    missing = [key for key in shape if key not in data]
+    return 'missing %s' % ', '.join(missing) if missing else None
+
+
+class InProcessTransport(object):
+    """ Sends requests through the Django test client to the URLconf of this process, with one client per thread. """
+
+    def __init__(self, host='testserver'):
+        self.host = host
+        self._local = threading.local()
+
+    def get(self, path):
+        """ Returns the status code, the content type and the content of the response to a GET request. """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(HTTP_HOST=self.host)
+        try:
+            response = client.get(path)
+        except Exception:   # the test client raises the errors which the server would answer with status 500
+            return 500, '', ''
+        content = ''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, response.get('Content-Type', ''), content
+
+
+class HttpTransport(object):
+    """ Sends requests to a running server, e.g. http://localhost:8000. """
+
+    def __init__(self, baseUrl, timeout=60):
+        self.baseUrl = baseUrl.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, path):
+        try:
+            response = urllib2.urlopen(self.baseUrl + path, timeout=self.timeout)
+        except urllib2.HTTPError as e:
+            return e.code, e.headers.get('Content-Type', ''), e.read()
+        except (urllib2.URLError, socket.error):   # counted as failed, like a gateway would answer them
+            return 502, '', ''
+        try:
+            return response.getcode(), response.headers.get('Content-Type', ''), response.read()
+        finally:
+            response.close()
+
+
+def replay(requests, transport, concurrency=1):
+    """ Sends the (view name, path, expected status) requests of a log with the transport in the given number of threads, and returns a
+        list of (view name, path, latency in seconds, problem) in the order of the requests, where problem is None for correct responses,
+        and the wall clock time it took.
+    """
+    results = [None] * len(requests)
+    remaining = iter(enumerate(requests))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                try:
+                    index, (name, path, expectedStatus) = next(remaining)
+                except StopIteration:
+                    return
+            start = time.time()
+            status, contentType, content = transport.get(path)
+            latency = time.time() - start
+            results[index] = (name, path, latency, checkResponse(name, status, contentType, content, expectedStatus))
+
+    start = time.time()
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def summarize(results, duration):
+    """ Returns the number of requests, of failed requests and the latency percentiles in milliseconds by view name, and for all of them
+        (as 'all') together with the throughput, from the results of replay().
+    """
+    groups = OrderedDict([('all', results)])
+    for result in results:
+        groups.setdefault(result[0], []).append(result)
+    summary = OrderedDict()
+    for name, group in groups.items():
+        latencies = np.array([latency for _, _, latency, _ in group]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[name] = OrderedDict([
+            ('requests', len(group)),
+            ('failures', sum(1 for _, _, _, problem in group if problem)),
+            ('p50_ms', round(p50, 3)),
+            ('p95_ms', round(p95, 3)),
+            ('p99_ms', round(p99, 3)),
+            ('mean_ms', round(latencies.mean(), 3)),
+        ])
+    summary['all']['throughput_per_s'] = round(len(results) / duration, 1) if duration else 0.0
+    return summary
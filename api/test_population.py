@@ -23,7 +23,7 @@ class TestDailyPopulationModel(unittest.TestCase):
 
     def setUp(self):
         # Create the three population models
-        self.pop_year = population.NpSingleYearPopulationModel("../data/WPP2012_INT_F3_Population_By_Sex_Annual_Single_100_Medium.csv", check_or_create_pickle=True)
+        self.pop_year = population.NpSingleYearPopulationModel("../data/WPP2012_INT_F3_Population_By_Sex_Annual_Single_100_Medium.csv", check_or_create_cache=True)
         self.pop_day = population.BicubicSplineDailyPopulationModel(self.pop_year)
         self.pop_oracle = population_original.OriginalDailyPopulationModel(self.pop_year)
 
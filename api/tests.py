@@ -1,15 +1,52 @@
-from datetime import date, timedelta
+import os
+import io
+import csv
+import json
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
 from unittest.case import skip
+import numpy as np
+import pandas as pd
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
 from django.test import SimpleTestCase
 from rest_framework.test import APISimpleTestCase
-from api.algorithms import worldPopulationRankByDate, dateByWorldPopulationRank, lifeExpectancyRemaining, populationCount, \
-    lifeExpectancyTotal, totalPopulation, calculateMortalityDistribution
+from api.algorithms import worldPopulationRankByDate, worldPopulationRankByDateBatch, dateByWorldPopulationRank, lifeExpectancyRemaining, lifeExpectancyRemainingArray, \
+    populationCount, populationCountColumns, lifeExpectancyTotal, lifeExpectancyAgeSpline, totalPopulation, calculateMortalityDistribution, pop_year, pop_day, rankCache, inverseTableCache
 from api.datastore import dataStore
+from api.decorators import response_cache_key, store_response_until_utc_eod
+from api import population
+from api.population import PopulationModel, NpSingleYearPopulationModel, BicubicSplineDailyPopulationModel, PopulationTotalsTable
+from api.lrucache import LRUCache
+from api.regions import RegionRegistry
+from api.utils import stream_json_array
+from api import benchmark, replay, timing, views
 from api.exceptions import *
 
 
 
+class TemporaryDirectoryMixin(object):
+    """
+    Gives each test an empty temporary directory self.directory, which is removed after the test.
+    """
+
+    def setUp(self):
+        super(TemporaryDirectoryMixin, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _writeFile(self, name, *lines):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+        return filename
+
+
 class AlgorithmTests(SimpleTestCase):
     """
     Tests the various calculation functions. All the reference values have been generated with the original R script (see modeling/R/).
@@ -23,6 +60,17 @@ class AlgorithmTests(SimpleTestCase):
         self.assertTrue('Estonia' in dataStore.countries)
         self.assertTrue('Reunion' in dataStore.countries)
 
+    def test_regionRegistry(self):
+        regions = RegionRegistry(['World', 'United Kingdom', 'Germany'])
+        self.assertEqual(['Germany', 'United Kingdom', 'World'], list(regions))
+        self.assertTrue('United Kingdom' in regions)
+        self.assertFalse('united kingdom' in regions)
+        self.assertEqual('United Kingdom', regions.lookup(' united_Kingdom'))
+        self.assertEqual('United Kingdom', regions.lookup('UK'))
+        self.assertEqual(None, regions.lookup('USA'))
+        self.assertEqual(sorted(dataStore.countries), list(dataStore.regions))
+        self.assertEqual(sorted(pop_year.get_regions()), pop_year.get_regions())
+
     def test_byDate_today(self):
         self.assertAlmostEqual(56598000,   worldPopulationRankByDate('unisex', 'World', date(2013, 12, 31), date(2014,  6,  1)), delta=AlgorithmTests.DELTA)
         self.assertAlmostEqual(2541178000, worldPopulationRankByDate('unisex', 'World', date(1993, 12,  6), date(2014,  6,  1)), delta=AlgorithmTests.DELTA)
@@ -46,6 +94,13 @@ class AlgorithmTests(SimpleTestCase):
     def test_byDate_invalidRegion(self):
         self.assertRaises(InvalidCountryError, worldPopulationRankByDate, 'unisex', 'THIS COUNTRY DOES NOT EXIST', date(1980, 1, 1), date(2000, 1, 1))
 
+    def test_byDate_misspelledRegion(self):
+        try:
+            worldPopulationRankByDate('unisex', 'united kingdom', date(1980, 1, 1), date(2000, 1, 1))
+            self.fail('InvalidCountryError not raised')
+        except InvalidCountryError as e:
+            self.assertTrue('did you mean United Kingdom?' in e.detail)
+
     def test_byDate_dobOutOfRange(self):
         self.assertRaises(BirthdateOutOfRangeError, worldPopulationRankByDate, 'unisex', 'World', date(1915, 1, 1), date(2000, 1, 1))
         self.assertRaises(BirthdateOutOfRangeError, worldPopulationRankByDate, 'unisex', 'World', date(2030, 1, 1), date(2000, 1, 1))
@@ -57,6 +112,32 @@ class AlgorithmTests(SimpleTestCase):
     def test_byDate_calculationTooWide(self):
         self.assertRaises(CalculationTooWideError, worldPopulationRankByDate, 'unisex', 'World', date(1930, 1, 1), date(2031, 1, 1))
 
+    def test_byDate_batch(self):
+        queries = [
+            ('unisex', 'World',          date(1993, 12,  6), date(2014,  6,  1)),
+            ('male',   'United Kingdom', date(1960,  2, 29), date(2001,  9, 11)),
+            ('unisex', 'World',          date(1920,  1,  1), date(2014,  1,  1)),
+            ('female', 'Brazil',         date(1980,  1,  1), date(1999, 12, 31)),
+        ]
+        self.assertEqual([worldPopulationRankByDate(*query) for query in queries], worldPopulationRankByDateBatch(queries))
+
+    def test_byDate_batch_invalidRegion(self):
+        self.assertRaises(InvalidCountryError, worldPopulationRankByDateBatch, [('unisex', 'World', date(1980, 1, 1), date(2000, 1, 1)), ('unisex', 'THIS COUNTRY DOES NOT EXIST', date(1980, 1, 1), date(2000, 1, 1))])
+
+    def test_popSumDobArray(self):
+        # a rank time series over the whole model range, including the edges, must match the scalar calculation exactly
+        min_date, max_date = pop_day.get_date_range()
+        dates = range(min_date, max_date + 1, 97) + [min_date + 1, max_date - 1, max_date]
+        dob = min_date - 10000
+        ranks = pop_day.pop_sum_dob_array(dates, 'World', 'All', dob, dates)
+        self.assertEqual([pop_day.pop_sum_dob(date, 'World', 'All', dob, date) for date in dates], ranks.tolist())
+
+    def test_popGrid(self):
+        # the grid of the single year model must be the same as the one assembled by the naive implementation from single values
+        grid = pop_year.pop_grid('World', 'All')
+        self.assertEqual(PopulationModel.pop_grid(pop_year, 'World', 'All').tolist(), grid.tolist())
+        self.assertFalse(grid.flags.writeable)
+
     def test_byRank(self):
         self.assertEqual(date(2049,  3, 11), dateByWorldPopulationRank('unisex', 'World', date(1993, 12,  6), 7000000000))
 
@@ -67,6 +148,22 @@ class AlgorithmTests(SimpleTestCase):
     def test_byRank_veryHighRank(self):
         self.assertEqual(date(2027, 11, 29), dateByWorldPopulationRank('unisex', 'World', date(2004, 11, 22), 3000000000))
 
+    def test_byRank_sameAsBinarySearch(self):
+        # the precomputed search of the daily model must find exactly the same dates as the plain binary search
+        dob = pop_day.get_date_range()[0] + 5000
+        for rank in [0, 1, 10000, 300000000, 3000000000, 7000000000, 20000000000]:
+            try:
+                expected = PopulationModel.pop_sum_dob_inverse_date(pop_day, rank, 'World', 'All', dob)
+            except ValueError:
+                self.assertRaises(ValueError, pop_day.pop_sum_dob_inverse_date, rank, 'World', 'All', dob)
+            else:
+                self.assertEqual(expected, pop_day.pop_sum_dob_inverse_date(rank, 'World', 'All', dob))
+        # the second search of a rank starts from the cached table
+        rank = pop_day.pop_sum_dob(dob + 10000, 'World', 'All', dob, dob + 10000)
+        hits = inverseTableCache.stats()['hits']
+        self.assertEqual(pop_day.pop_sum_dob_inverse_date(rank, 'World', 'All', dob), pop_day.pop_sum_dob_inverse_date(rank, 'World', 'All', dob))
+        self.assertTrue(inverseTableCache.stats()['hits'] > hits)
+
     def test_lifeExpectancyRemaining(self):
         self.assertAlmostEqual(28.53, lifeExpectancyRemaining('female', 'World', date(2049, 3, 11), relativedelta(years=55, months=4)), places=0)
         self.assertAlmostEqual(32.80, lifeExpectancyRemaining('male', 'United Kingdom', date(2001, 5, 11), relativedelta(years=49)), places=0)
@@ -75,6 +172,21 @@ class AlgorithmTests(SimpleTestCase):
         self.assertAlmostEqual(1.12, lifeExpectancyRemaining('female', 'Afghanistan', date(1955, 1, 1), relativedelta(years=120)), places=0)
         self.assertAlmostEqual(1.12, lifeExpectancyRemaining('male', 'United Kingdom', date(2050, 1, 1), relativedelta(years=120)), places=0)
 
+    def test_lifeExpectancyRemainingArray(self):
+        ages = [relativedelta(years=years, months=years % 12) for years in range(0, 121, 7)]
+        refdates = [date(1955, 1, 1) + relativedelta(years=years, days=years) for years in range(0, 91, 7)]
+        self.assertEqual([lifeExpectancyRemaining('female', 'Brazil', date(2015, 6, 30), age) for age in ages], lifeExpectancyRemainingArray('female', 'Brazil', [date(2015, 6, 30)], ages).tolist())
+        self.assertEqual([lifeExpectancyRemaining('male', 'World', refdate, relativedelta(years=30)) for refdate in refdates], lifeExpectancyRemainingArray('male', 'World', refdates, [relativedelta(years=30)]).tolist())
+        self.assertEqual([lifeExpectancyRemaining('male', 'World', refdate, age) for refdate, age in zip(refdates, ages)], lifeExpectancyRemainingArray('male', 'World', refdates, ages[:len(refdates)]).tolist())
+        self.assertRaises(AgeOutOfRangeError, lifeExpectancyRemainingArray, 'male', 'World', [date(2015, 6, 30)], [relativedelta(years=30), relativedelta(years=121)])
+
+    def test_lifeExpectancyIndex(self):
+        # the indexed rows must be the rows of the table, and the fitted splines must be reused
+        table = dataStore.life_expectancy_ages
+        row = table[(table.region == 'United Kingdom') & (table.sex == 2) & (table.Begin_prd == 2010)]
+        self.assertEqual(row.iloc[0, 4:].tolist(), dataStore.life_expectancy_values[dataStore.life_expectancy_index[('United Kingdom', 2, 2010)]].tolist())
+        self.assertIs(lifeExpectancyAgeSpline('United Kingdom', 2, 2010), lifeExpectancyAgeSpline('United Kingdom', 2, 2010.0))
+
     def test_lifeExpectancyTotal(self):
         self.assertAlmostEqual(90.34, lifeExpectancyTotal('female', 'World', date(2015, 6, 30)), places=0)
 
@@ -87,6 +199,14 @@ class AlgorithmTests(SimpleTestCase):
         self.assertEqual(1980, data[30]['year'])
         self.assertEqual(2719710, data[30]['total'])
 
+    def test_populationCountColumns(self):
+        # the table sliced out of the population grids must be the same as the one looked up cell by cell
+        for age, year in ((18, None), (None, 1980), (100, 2100)):
+            columns = populationCountColumns('Brazil', age, year)
+            expected = [(y, a, pop_year.pop_age(y, 'Brazil', 'M', a), pop_year.pop_age(y, 'Brazil', 'F', a), pop_year.pop_age(y, 'Brazil', 'All', a))
+                        for a in ([age] if age else pop_year.ages()) for y in ([year] if year else pop_year.dates())]
+            self.assertEqual(expected, zip(*[columns[name].tolist() for name in ('year', 'age', 'males', 'females', 'total')]))
+
     def test_total_population(self):
         self.assertEqual(totalPopulation('United Kingdom', date(2013, 1, 1)), 62961264)
         self.assertEqual(totalPopulation('Afghanistan', date(2022, 12, 31)), 37599673)
@@ -95,6 +215,291 @@ class AlgorithmTests(SimpleTestCase):
     def test_mortality_distribution(self):
         self.assertEqual(calculateMortalityDistribution('Germany', 'male', relativedelta(years=43, months=3))[3][1],2.2179399450663992)            
 
+    def test_mortality_distribution_cached(self):
+        # distributions of the same age band are calculated once per day, and the exact age is applied to them afterwards
+        dataStore.mortality_distributions.clear()
+        first = calculateMortalityDistribution('Brazil', 'female', relativedelta(years=61))
+        hits = dataStore.mortality_distributions.stats()['hits']
+        second = calculateMortalityDistribution('Brazil', 'female', relativedelta(years=63, months=6))
+        self.assertEqual(hits + 1, dataStore.mortality_distributions.stats()['hits'])
+        self.assertEqual([row[0] for row in first], [row[0] for row in second])
+        self.assertTrue(first[1][1] > second[1][1])
+        self.assertAlmostEqual(100, sum(row[1] for row in second))
+        self.assertEqual([row.tolist() for row in calculateMortalityDistribution('Brazil', 'female', relativedelta(years=61))], [row.tolist() for row in first])
+
+    def test_mortality_distribution_young(self):
+        distribution = calculateMortalityDistribution('World', 'male', relativedelta(years=3, months=6))
+        self.assertAlmostEqual(3.5, distribution[0][0])
+        self.assertAlmostEqual(100, sum(row[1] for row in distribution))
+
+
+class PopulationFileTests(TemporaryDirectoryMixin, SimpleTestCase):
+    """
+    Tests saving and loading the interpolation models and the total population table.
+    """
+
+    def test_populationTotalsTable(self):
+        # the table must hold exactly the same totals as the interpolation model, also after saving and loading it
+        date_from = population.to_epoch_days(date(2015, 12, 20))
+        table = PopulationTotalsTable.build(pop_day, 'All', date_from, date_from + 20)
+        filename = os.path.join(self.directory, 'totals.npz')
+        table.save(filename)
+        self.assertEqual(['totals.npz'], os.listdir(self.directory))
+        loaded = PopulationTotalsTable.load(filename)
+        for region in pop_day.get_regions():
+            for day in range(date_from, date_from + 21):
+                self.assertEqual(pop_day.pop_sum_age(day, region, 'All'), table.get(day, region))
+                self.assertEqual(pop_day.pop_sum_age(day, region, 'All'), loaded.get(day, region))
+        self.assertEqual([], loaded.check(pop_day, samples=100))
+        # the fingerprint of the population data is saved with the table, and differs for other data (here another enumeration day)
+        self.assertTrue(loaded.is_built_from(pop_day))
+        self.assertFalse(loaded.is_built_from(BicubicSplineDailyPopulationModel(pop_year, enum_day=2)))
+        self.assertFalse(PopulationTotalsTable(loaded.regions, 'All', date_from, loaded.totals).is_built_from(pop_day))
+        self.assertRaises(ValueError, loaded.get, date_from + 21, 'World')
+        self.assertEqual(pop_day.pop_sum_age(population.to_epoch_days(date(2022, 12, 31)), 'World', 'All'), totalPopulation('World', date(2022, 12, 31)))
+
+    def test_modelCache(self):
+        # models loaded from the cache file must give exactly the same results as freshly built ones
+        filename = os.path.join(self.directory, 'models.npz')
+        pop_day.get_model('World', 'All')
+        pop_day.save_models(filename)
+        loaded = BicubicSplineDailyPopulationModel(pop_year)
+        self.assertTrue(loaded.load_models(filename))
+        # models of different population data (here another enumeration day) must not be loaded
+        stale = BicubicSplineDailyPopulationModel(pop_year, enum_day=2)
+        self.assertFalse(stale.load_models(filename))
+        self.assertEqual({}, dict(stale.models))
+        self.assertEqual(['models.npz'], os.listdir(self.directory))
+        self.assertEqual(pop_day.pop_sum_age(16000, 'World', 'All', 5000, 9000), loaded.pop_sum_age(16000, 'World', 'All', 5000, 9000))
+        self.assertEqual(pop_day.pop_age(16000, 'World', 'All', 5000), loaded.pop_age(16000, 'World', 'All', 5000))
+
+
+class UtilsTests(SimpleTestCase):
+    """
+    Tests the helper functions of the views.
+    """
+
+    def test_streamJsonArray(self):
+        for items in ([{'a': 1}, 2, 'three'], ({'a': 1}, 2, 'three'), iter([{'a': 1}, 2, 'three'])):
+            self.assertEqual([{'a': 1}, 2, 'three'], json.loads(''.join(stream_json_array(items, chunk_size=2))))
+        self.assertEqual([], json.loads(''.join(stream_json_array([]))))
+
+
+class PopulationCsvTests(TemporaryDirectoryMixin, SimpleTestCase):
+    """
+    Tests loading the single year population model from small CSV files.
+    """
+
+    HEADER = 'SortOrder,LocID,Location,VarID,Variant,Time,Age,PopMale,PopFemale,PopTotal'
+
+    def _writeCsv(self, *rows):
+        return self._writeFile('population.csv', self.HEADER, *rows)
+
+    def test_populationCsv(self):
+        # the values in the CSV are in thousands and must be rounded to whole persons
+        model = NpSingleYearPopulationModel(self._writeCsv('1,100,World,2,Medium,1950,0,39585.824,38801.947,78387.771', '2,100,World,2,Medium,2100,100,0.0004,0.001,0.0014'))
+        self.assertEqual(['World'], model.get_regions())
+        self.assertEqual([39585824, 38801947, 78387771], [model.pop_age(1950, 'World', sex, 0) for sex in ('M', 'F', 'All')])
+        self.assertEqual([0, 1, 1], [model.pop_age(2100, 'World', sex, 100) for sex in ('M', 'F', 'All')])
+
+    def test_populationDtype(self):
+        # integer types must hold exactly the same figures, but values which don't fit must be rejected
+        filename = self._writeCsv('1,100,World,2,Medium,1950,0,39585.824,38801.947,78387.771', '2,100,World,2,Medium,2100,100,2147483.647,2147483.648,4294967.295')
+        self.assertEqual(78387771, NpSingleYearPopulationModel(filename, dtype='uint32').pop_age(1950, 'World', 'All', 0))
+        self.assertEqual(4294967295, NpSingleYearPopulationModel(filename, dtype='uint32').pop_age(2100, 'World', 'All', 100))
+        self.assertRaises(ValueError, NpSingleYearPopulationModel, filename, dtype='int32')
+
+    def test_populationCache(self):
+        # a model loaded from the memory mapped cache files must contain exactly the same arrays as the one which created them
+        filename = self._writeCsv('1,100,World,2,Medium,1950,0,39585.824,38801.947,78387.771', '2,900,Brazil,2,Medium,2100,100,2.5,1.25,3.75')
+        created = NpSingleYearPopulationModel(filename, check_or_create_cache=True)
+        loaded = NpSingleYearPopulationModel(filename, check_or_create_cache=True)
+        self.assertTrue(os.path.exists(filename + '.float64.npy'))
+        self.assertEqual(sorted(created.get_regions()), sorted(loaded.get_regions()))
+        for region in created.get_regions():
+            for sex in created.get_sexes():
+                self.assertTrue(np.array_equal(created.arrays[region][sex], loaded.arrays[region][sex]))
+
+
+class LRUCacheTests(SimpleTestCase):
+    """
+    Tests the in-memory result cache.
+    """
+
+    def test_evictsLeastRecentlyUsed(self):
+        cache = LRUCache(maxEntries=2, maxBytes=1024 * 1024)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.getOrCompute('a', lambda: None))
+        cache.put('c', 3)
+        self.assertEqual('computed', cache.getOrCompute('b', lambda: 'computed'))
+        self.assertEqual({'entries': 2, 'hits': 1, 'misses': 1, 'evictions': 2}, dict((key, value) for key, value in cache.stats().items() if key != 'bytes'))
+
+    def test_evictsByBytes(self):
+        cache = LRUCache(maxEntries=100, maxBytes=1000)
+        for i in range(100):
+            cache.put(i, 'x' * 100)
+        self.assertTrue(0 < cache.stats()['entries'] < 10)
+        self.assertTrue(cache.stats()['bytes'] <= 1000)
+
+    def test_doesNotCacheExceptions(self):
+        cache = LRUCache(maxEntries=10, maxBytes=1024 * 1024)
+        def fail():
+            raise ValueError()
+        self.assertRaises(ValueError, cache.getOrCompute, 'a', fail)
+        self.assertEqual(0, cache.stats()['entries'])
+
+    def test_rankCache(self):
+        rankCache.clear()
+        rank = worldPopulationRankByDate('male', 'World', date(1980, 1, 1), date(2001, 9, 11))
+        hits = rankCache.stats()['hits']
+        self.assertEqual(rank, worldPopulationRankByDate('male', 'World', date(1980, 1, 1), date(2001, 9, 11)))
+        self.assertEqual(hits + 1, rankCache.stats()['hits'])
+
+
+class BuildTablesTests(TemporaryDirectoryMixin, SimpleTestCase):
+    """
+    Tests the buildtables command with a simple table builder, as the extrapolation tables themselves take far too long to build.
+    """
+
+    def setUp(self):
+        super(BuildTablesTests, self).setUp()
+        self.built = []
+        def buildTable(sex, country):
+            self.built.append((sex, country))
+            return pd.DataFrame({'sex': [sex], 'country': [country]})
+        dataStore.registerTableBuilder(buildTable)
+
+    def tearDown(self):
+        dataStore.registerTableBuilder(None)
+
+    def _buildTables(self, **options):
+        with override_settings(DATA_STORE_PATH=self.directory):
+            call_command('buildtables', stdout=io.BytesIO(), **options)
+
+    def test_buildTables(self):
+        self._buildTables(only='Germany,united kingdom', workers=2)
+        self.assertEqual(['female-Germany.pkl', 'female-United_Kingdom.pkl', 'male-Germany.pkl', 'male-United_Kingdom.pkl', 'unisex-Germany.pkl',
+            'unisex-United_Kingdom.pkl'], sorted(os.listdir(self.directory)))
+        table = pd.read_pickle(os.path.join(self.directory, 'male-Germany.pkl'))
+        self.assertEqual(('male', 'Germany'), (table.sex[0], table.country[0]))
+        self.assertRaises(CommandError, self._buildTables, only='Atlantis')
+
+    def test_buildTables_resume(self):
+        with open(os.path.join(self.directory, 'buildtables-manifest.json'), 'w') as f:
+            json.dump({'completed': [['female', 'Germany'], ['male', 'Germany']]}, f)
+        self._buildTables(only='Germany')
+        self.assertEqual([('unisex', 'Germany')], self.built)
+        # the run over all countries isn't finished yet, so its progress must be kept
+        self.assertEqual(['buildtables-manifest.json', 'unisex-Germany.pkl'], sorted(os.listdir(self.directory)))
+        with open(os.path.join(self.directory, 'buildtables-manifest.json')) as f:
+            self.assertEqual([['female', 'Germany'], ['male', 'Germany'], ['unisex', 'Germany']], json.load(f)['completed'])
+
+        self._buildTables(only='Germany,Brazil', skip_existing=True, restart=True)
+        self.assertEqual([('unisex', 'Germany'), ('female', 'Germany'), ('female', 'Brazil'), ('male', 'Germany'), ('male', 'Brazil'),
+            ('unisex', 'Brazil')], self.built)
+
+    def test_buildTables_finishManifest(self):
+        # the manifest is removed once the tables of all countries have been regenerated, also by a run of --only countries
+        with open(os.path.join(self.directory, 'buildtables-manifest.json'), 'w') as f:
+            json.dump({'completed': [[sex, country] for sex in ('female', 'male', 'unisex') for country in dataStore.countries if country != 'Germany']}, f)
+        self._buildTables(only='Germany')
+        self.assertEqual([('female', 'Germany'), ('male', 'Germany'), ('unisex', 'Germany')], self.built)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'buildtables-manifest.json')))
+
+    def test_buildTables_withoutBuilder(self):
+        dataStore.registerTableBuilder(None)
+        self.assertRaises(CommandError, self._buildTables, only='Germany')
+        self.assertEqual([], os.listdir(self.directory))
+
+
+class BenchmarkTests(TemporaryDirectoryMixin, SimpleTestCase):
+    """
+    Tests the benchmark, profiling and replay tools with a few quick calls.
+    """
+
+    def _writeRequestLog(self, *lines):
+        return self._writeFile('requests.log', *lines)
+
+    def test_runBenchmark(self):
+        sampler = benchmark.ParameterSampler(dataStore.countries, seed=1)
+        stats = benchmark.runBenchmark(benchmark.algorithmCalls('totalPopulation', sampler, 6), warmup=2, concurrency=2)
+        self.assertEqual((4, 0), (stats['calls'], stats['failures']))
+        self.assertTrue(0 < stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms'])
+        stats = benchmark.runBenchmark(benchmark.endpointCalls('list_countries', sampler, 3))
+        self.assertEqual((3, 0), (stats['calls'], stats['failures']))
+
+    def test_readRequestLog(self):
+        requests = benchmark.readRequestLog(self._writeRequestLog(
+            '{"path": "/1.0/countries/"}',
+            '127.0.0.1 - - [01/Jan/2015:00:00:00 +0000] "GET /1.0/wp-rank/1980-01-01/male/World/today/ HTTP/1.1" 200 95',
+            '/1.0/life-expectancy/remaining/female/World/2015-06-30/?ages=20y,30y',
+            '/1.0/does-not-exist/',
+            '/1.0/countries/'))
+        self.assertEqual(['list_countries', 'world_population_rank_today', 'calculate_remaining_life_expectancy_curve'], list(requests))
+        self.assertEqual(['/1.0/countries/', '/1.0/countries/'], requests['list_countries'])
+        self.assertEqual(['/1.0/life-expectancy/remaining/female/World/2015-06-30/?ages=20y,30y'], requests['calculate_remaining_life_expectancy_curve'])
+
+    def test_profileReplay(self):
+        filename = self._writeRequestLog('/1.0/wp-rank/1961-04-12/male/World/aged/33y/', '/1.0/countries/')   # not in the response cache yet
+        output = io.BytesIO()
+        call_command('profilereplay', filename, preload=False, restrict='views', stdout=output)
+        self.assertTrue('Replayed 2 requests' in output.getvalue())
+        self.assertTrue('world_population_rank_by_age' in output.getvalue())
+        self.assertFalse('decorators.py' in output.getvalue())
+
+    def test_replay(self):
+        filename = self._writeRequestLog(
+            '{"path": "/1.0/countries/", "status": 200}',
+            '{"path": "/1.0/wp-rank/1952-03-11/unisex/123/today/", "status": 400}',
+            '/1.0/population/1980/Brazil/')
+        output = io.BytesIO()
+        call_command('replay', filename, preload=False, concurrency=2, repeat=2, fail_on_errors=True, stdout=output)
+        self.assertTrue('Replayed 6 requests' in output.getvalue())
+        self.assertTrue('retrieve_population_table' in output.getvalue())
+
+    def test_checkResponse(self):
+        self.assertEqual(None, replay.checkResponse('status', 200, 'application/json', '{"ready": true, "loaded": true}'))
+        self.assertEqual(None, replay.checkResponse('status', 503, 'application/json', '{"ready": false}', 503))
+        self.assertEqual('status 503', replay.checkResponse('status', 503, 'application/json', '{"ready": false}'))
+        self.assertEqual('status 200 instead of 400', replay.checkResponse('status', 200, 'application/json', '{"ready": true}', 400))
+        self.assertEqual('missing ready, loaded', replay.checkResponse('status', 200, 'application/json', '{}'))
+        self.assertEqual('not a JSON array', replay.checkResponse('retrieve_population_table', 200, 'application/json', '{}'))
+        self.assertEqual(None, replay.checkResponse('retrieve_population_table', 200, 'text/csv', 'year,age'))
+
+    def test_compareResults(self):
+        baseline = {'benchmarks': {'a': {'p50_ms': 2.0}, 'b': {'p50_ms': 2.0}}}
+        results = {'benchmarks': {'a': {'p50_ms': 2.2}, 'b': {'p50_ms': 3.0}, 'c': {'p50_ms': 1.0}}}
+        self.assertEqual([('a', 2.0, 2.2, 1.1, False), ('b', 2.0, 3.0, 1.5, True)], sorted(benchmark.compareResults(baseline, results, threshold=1.2)))
+
+
+class TimingTests(SimpleTestCase):
+    """
+    Tests the timing of the spans of requests.
+    """
+
+    def test_spans(self):
+        @timing.timed('outer')
+        def outer(depth):
+            with timing.span('inner'):
+                return outer(depth - 1) if depth else 'result'
+
+        self.assertEqual('result', outer(3))   # outside of requests, nothing is timed
+        timer = timing.startRequest()
+        self.assertEqual('result', outer(3))
+        finished = timing.finishRequest()
+        self.assertTrue(finished is timer)
+        self.assertEqual(['outer', 'inner', 'total'], list(timer.spans))
+        self.assertTrue(timer.spans['inner'] <= timer.spans['outer'] <= timer.spans['total'])
+        self.assertEqual(None, timing.currentTimer())
+        self.assertRegexpMatches(timer.header(), r'^outer;dur=\d+\.\d{3}, inner;dur=\d+\.\d{3}, total;dur=\d+\.\d{3}$')
+
+    def test_histogram(self):
+        histogram = timing.Histogram(buckets=(1, 10))
+        for duration in (0.5, 1, 5, 20):
+            histogram.observe(duration)
+        self.assertEqual({'buckets': [1, 10], 'counts': [2, 1, 1], 'count': 4, 'sum': 26.5}, histogram.snapshot())
+
 
 class ApiIntegrationTests(APISimpleTestCase):
     """
@@ -109,6 +514,152 @@ class ApiIntegrationTests(APISimpleTestCase):
         else:
             self.assertEqual(response.status_code, 200)
 
+    def _testBatchEndpoint(self, queries, expectErrorContaining=None):
+        response = self.client.post('/1.0/wp-rank/batch/', queries, format='json')
+        if expectErrorContaining:
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(expectErrorContaining in response.data['detail'], 'Expected fragment "%s" in error message: %s' % (expectErrorContaining, response.data['detail']))
+        else:
+            self.assertEqual(response.status_code, 200)
+
+    def testStatusEndpoint_ready(self):
+        # load the data on demand, as any request would
+        self.assertTrue(dataStore.countries and pop_day.get_regions())
+        self._testEndpoint('/status/')
+
+    def testStatusEndpoint_notLoaded(self):
+        # without preloading, the data is only loaded by the requests which need it, so the server must be ready for them before
+        isDataLoaded = views.isDataLoaded
+        views.isDataLoaded = lambda: False
+        try:
+            with override_settings(PRELOAD_DATA=False, LOAD_DATA_IN_BACKGROUND=False):
+                response = self.client.get('/1.0/status/')
+                self.assertEqual(200, response.status_code)
+                self.assertEqual({'ready': True, 'loaded': False}, response.data)
+            with override_settings(PRELOAD_DATA=False, LOAD_DATA_IN_BACKGROUND=True):
+                response = self.client.get('/1.0/status/')
+                self.assertEqual(503, response.status_code)
+                self.assertEqual({'ready': False, 'loaded': False}, response.data)
+        finally:
+            views.isDataLoaded = isDataLoaded
+
+    def testServerTimingHeader(self):
+        with override_settings(SERVER_TIMING_HEADER=False):
+            self.assertFalse(self.client.get('/1.0/countries/').has_header('Server-Timing'))
+        with override_settings(SERVER_TIMING_HEADER=True):
+            response = self.client.get('/1.0/wp-rank/1951-07-13/unisex/World/aged/47y1m/')   # not calculated by other tests, so that nothing is cached
+        spans = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual('parse', spans[0])
+        self.assertTrue('validate' in spans)
+        self.assertTrue('model' in spans and 'integrate' in spans)
+        self.assertTrue('render' in spans)
+        self.assertEqual('total', spans[-1])
+
+    def testMetricsEndpoint(self):
+        self._testEndpoint('/countries/')
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(404, self.client.get('/metrics/').status_code)
+        with override_settings(METRICS_ENABLED=True, METRICS_TOKEN='token'):
+            self.assertEqual(403, self.client.get('/metrics/').status_code)
+            self.assertEqual(403, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code)
+            self.assertEqual(200, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer token').status_code)
+        with override_settings(METRICS_ENABLED=True, METRICS_TOKEN=None):
+            response = self.client.get('/metrics/')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.splitlines()
+        self.assertTrue(any(line.startswith('populationio_requests_total{status="200",view="list_countries"} ') for line in lines))
+        self.assertTrue('populationio_request_duration_seconds_bucket{le="+Inf",view="list_countries"}' in response.content)
+        self.assertTrue(any(line.startswith('process_max_resident_memory_bytes ') for line in lines))
+        self.assertTrue(all(line.startswith('#') or len(line.split(' ')) == 2 for line in lines))
+
+    def testProfiling(self):
+        path = '/1.0/wp-rank/1952-03-11/unisex/World/aged/49y2m/?__profile=1&__profile_limit=5'
+        with override_settings(PROFILING_SECRET=None):
+            self.assertEqual(1952, self.client.get(path, HTTP_X_PROFILING_SECRET='').data['dob'].year)
+        with override_settings(PROFILING_SECRET='secret', PROFILING_PATH=None):
+            self.assertEqual(403, self.client.get(path, HTTP_X_PROFILING_SECRET='wrong').status_code)
+            self.assertEqual(400, self.client.get(path + '&__profile_sort=nothing', HTTP_X_PROFILING_SECRET='secret').status_code)
+            response = self.client.get(path, HTTP_X_PROFILING_SECRET='secret')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('200', response['X-Profiled-Status'])
+        self.assertTrue('function calls' in response.content)
+
+    def testResponseCache(self):
+        cache = get_cache(settings.RESPONSE_CACHE_ALIAS)
+        cache.clear()
+        response = self.client.get('/1.0/wp-rank/1952-03-11/male/United%20Kingdom/aged/14m/')
+        self.assertEqual(response.status_code, 200)
+        # the same offset written differently is answered from the cache
+        key = response_cache_key('api.views.world_population_rank_by_age', {'dob': date(1952, 3, 11), 'sex': 'male', 'country': 'United Kingdom', 'age': relativedelta(years=1, months=2)})
+        self.assertEqual(cache.get(key), response.data)
+        cache.set(key, {'rank': 'cached'})
+        self.assertEqual(self.client.get('/1.0/wp-rank/1952-03-11/male/United%20Kingdom/aged/1y2m/').data, {'rank': 'cached'})
+        # errors are not cached
+        self._testEndpoint('/wp-rank/1952-03-11/male/123/aged/1y2m/', expectErrorContaining='country')
+        self._testEndpoint('/wp-rank/1952-03-11/male/123/aged/1y2m/', expectErrorContaining='country')
+        cache.clear()
+
+    def testResponseCache_untilUtcEod(self):
+        cache = get_cache(settings.RESPONSE_CACHE_ALIAS)
+        cache.clear()
+        today = datetime.utcnow().date()
+        # responses prepared ahead of time are used on their day only, and not stored at all once that day is over
+        store_response_until_utc_eod('api.views.retrieve_total_population_now', {'country': 'World'}, today, {'total_population': 'prepared'})
+        store_response_until_utc_eod('api.views.retrieve_total_population_now', {'country': 'Germany'}, today - timedelta(days=1), {'total_population': 'outdated'})
+        self.assertEqual(self.client.get('/1.0/population/World/today-and-tomorrow/').data, {'total_population': 'prepared'})
+        self.assertIsNone(cache.get(response_cache_key('api.views.retrieve_total_population_now', {'country': 'Germany'}, today - timedelta(days=1))))
+        self.assertIsNone(cache.get(response_cache_key('api.views.retrieve_total_population_now', {'country': 'World'})))
+        cache.clear()
+
+    def testPopulationTableEndpoint_streaming(self):
+        # the streamed table must be the same as the one rendered at once
+        get_cache(settings.RESPONSE_CACHE_ALIAS).clear()
+        response = self.client.get('/1.0/population/1980/Brazil/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(''.join(response.streaming_content)), populationCount('Brazil', None, 1980))
+        # the streamed rows are stored in the response cache, and the next request is answered from it
+        response = self.client.get('/1.0/population/1980/Brazil/')
+        self.assertFalse(response.streaming)
+        self.assertEqual(json.loads(response.content), populationCount('Brazil', None, 1980))
+        self.assertEqual(json.loads(self.client.get('/1.0/population/1980/Brazil/', HTTP_ACCEPT='application/json; indent=4').content), populationCount('Brazil', None, 1980))
+        get_cache(settings.RESPONSE_CACHE_ALIAS).clear()
+
+    def testPopulationTableEndpoint_formats(self):
+        expected = populationCount('Brazil', 18)
+        response = self.client.get('/1.0/population/Brazil/18/?format=columns')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['total'], [row['total'] for row in expected])
+        response = self.client.get('/1.0/population/Brazil/18/', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(list(csv.DictReader(io.BytesIO(response.content))), [dict((name, str(value)) for name, value in row.items()) for row in expected])
+        table = np.load(io.BytesIO(self.client.get('/1.0/population/Brazil/18/?format=npy').content))
+        self.assertEqual(('year', 'age', 'males', 'females', 'total'), table.dtype.names)
+        self.assertEqual(table['males'].tolist(), [row['males'] for row in expected])
+        # errors are rendered in the requested format as well
+        response = self.client.get('/1.0/population/Brazil/101/?format=csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith('detail\r\n'))
+        # the other endpoints don't respond with tables, so they don't offer these formats
+        self.assertEqual(404, self.client.get('/1.0/wp-rank/1952-03-11/unisex/World/today/?format=npy').status_code)
+        self.assertEqual(406, self.client.get('/1.0/countries/', HTTP_ACCEPT='text/csv').status_code)
+
+    def testMortalityDistributionEndpoint_formats(self):
+        response = self.client.get('/1.0/mortality-distribution/United%20Kingdom/male/49y2m/today/?format=columns')
+        self.assertEqual(response.status_code, 200)
+        expected = calculateMortalityDistribution('United Kingdom', 'male', relativedelta(years=49, months=2))
+        self.assertEqual(json.loads(response.content), {'age': [val[0] for val in expected], 'mortality_percent': [val[1] for val in expected]})
+
+    def testLifeExpectancyCurveEndpoint(self):
+        response = self.client.get('/1.0/life-expectancy/remaining/female/World/2015-06-30/?ages=20y,30y,65y6m')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(['20y', '30y', '65y6m'], [row['age'] for row in response.data['remaining_life_expectancies']])
+        self.assertEqual(lifeExpectancyRemaining('female', 'World', date(2015, 6, 30), relativedelta(years=65, months=6)), response.data['remaining_life_expectancies'][2]['remaining_life_expectancy'])
+        self._testEndpoint('/life-expectancy/remaining/female/World/2015-06-30/?ages=20y,3x', expectErrorContaining='offset')
+        self._testEndpoint('/life-expectancy/remaining/female/World/2015-06-30/', expectErrorContaining='offset')
+        self._testEndpoint('/life-expectancy/remaining/female/World/2015-06-30/?ages=20y,121y', expectErrorContaining='age')
+
     def testRankEndpointToday_success(self):
         self._testEndpoint('/wp-rank/1952-03-11/unisex/World/today/')
 
@@ -128,6 +679,16 @@ class ApiIntegrationTests(APISimpleTestCase):
     def testRankEndpointAged_invalidOffset(self):
         self._testEndpoint('/wp-rank/1952-03-11/unisex/World/aged/5x/', expectErrorContaining='offset')
 
+    def testRankEndpointBatch_success(self):
+        self._testBatchEndpoint([{'dob': '1952-03-11', 'sex': 'unisex', 'country': 'World', 'date': '2001-09-11'}, {'dob': '1993-12-06', 'sex': 'male', 'country': 'United Kingdom', 'date': '2014-06-01'}])
+
+    def testRankEndpointBatch_invalidBody(self):
+        self._testBatchEndpoint({'dob': '1952-03-11', 'sex': 'unisex', 'country': 'World', 'date': '2001-09-11'}, expectErrorContaining='JSON array')
+        self._testBatchEndpoint([{'dob': '1952-03-11', 'sex': 'unisex', 'country': 'World'}], expectErrorContaining='query #0')
+
+    def testRankEndpointBatch_invalidCountry(self):
+        self._testBatchEndpoint([{'dob': '1952-03-11', 'sex': 'unisex', 'country': 'World', 'date': '2001-09-11'}, {'dob': '1952-03-11', 'sex': 'unisex', 'country': '123', 'date': '2001-09-11'}], expectErrorContaining='country')
+
     def testPopulationEndpoint_successCountryAndAgeOnly(self):
         self._testEndpoint('/population/Brazil/18/')
 
@@ -0,0 +1,136 @@
+import time, bisect, functools, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# the upper bounds of the buckets of the duration histograms in milliseconds (the last bucket is unbounded)
+HISTOGRAM_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_local = threading.local()
+
+
+class Histogram(object):
+    """ A thread-safe histogram of durations in milliseconds, which counts them in fixed buckets and keeps their sum. """
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, duration):
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += duration
+
+    def snapshot(self):
+        """ Returns the number of durations in each bucket (the last one being unbounded), their total number and their sum as a dict. """
+        with self._lock:
+            return {'buckets': list(self.buckets), 'counts': list(self._counts), 'count': sum(self._counts), 'sum': self._sum}
+
+
+class HistogramSet(object):
+    """ A thread-safe set of histograms by name, which are created when they are first observed. """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, duration):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        histogram.observe(duration)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+        return dict((name, histogram.snapshot()) for name, histogram in histograms.items())
+
+
+# the durations of the spans of all requests timed so far, by span name (including 'total')
+spanHistograms = HistogramSet()
+
+
+class RequestTimer(object):
+    """ Collects the time spent in the spans of a request, summed by span name. A span which is entered again while it is active (e.g.
+        by recursion or nested validation functions) is only timed once.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans = OrderedDict()
+        self.renderStart = None   # set by the middleware when the response is rendered
+        self.view = None          # the name of the view which answers the request, set by the middleware
+        self._active = set()
+
+    def enter(self, name):
+        """ Returns the start time of the span, or None if a span of that name is already active. """
+        if name in self._active:
+            return None
+        self._active.add(name)
+        self.spans.setdefault(name, 0.0)   # keep the spans in the order in which they started
+        return time.time()
+
+    def exit(self, name, start):
+        if start is not None:
+            self._active.discard(name)
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds * 1000
+
+    def header(self):
+        """ Returns the spans in the format of the Server-Timing header, with their durations in milliseconds. """
+        return ', '.join('%s;dur=%.3f' % (name, duration) for name, duration in self.spans.items())
+
+
+def startRequest():
+    """ Starts timing the request handled by the current thread, see RequestTimer. """
+    _local.timer = RequestTimer()
+    return _local.timer
+
+def finishRequest():
+    """ Stops timing the request handled by the current thread, records its spans in spanHistograms and returns its RequestTimer (or
+        None if no request is timed).
+    """
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    if timer is not None:
+        timer.add('total', time.time() - timer.start)
+        for name, duration in timer.spans.items():
+            spanHistograms.observe(name, duration)
+    return timer
+
+def currentTimer():
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def span(name):
+    """ Times the enclosed block as a span of the current request. Outside of timed requests, this does nothing. """
+    timer = getattr(_local, 'timer', None)
+    start = timer.enter(name) if timer is not None else None
+    try:
+        yield
+    finally:
+        if start is not None:
+            timer.exit(name, start)
+
+def timed(name):
+    """ Decorates a function to time its calls as spans of the current request, see span(). """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            timer = getattr(_local, 'timer', None)
+            if timer is None:
+                return function(*args, **kwargs)
+            start = timer.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.exit(name, start)
+        return wrapper
+    return decorator
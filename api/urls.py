@@ -26,11 +26,16 @@ urlpatterns = [
     url(r'wp-rank/' + PERSON_PATH + r'ago/(?P<offset>[^/]+)/', views.world_population_rank_in_past),
     url(r'wp-rank/' + PERSON_PATH + r'in/(?P<offset>[^/]+)/', views.world_population_rank_in_future),
     url(r'wp-rank/' + PERSON_PATH + r'ranked/(?P<rank>[^/]+)/', views.date_by_world_population_rank),
+    url(r'wp-rank/batch/', views.world_population_rank_batch),
 
     # /api/1.0/life-expectancy/
     url(r'life-expectancy/remaining/(?P<sex>[^/]+)/(?P<country>[^/]+)/(?P<date>[^/]+)/(?P<age>[^/]+)/', views.calculate_remaining_life_expectancy),
+    url(r'life-expectancy/remaining/(?P<sex>[^/]+)/(?P<country>[^/]+)/(?P<date>[^/]+)/$', views.calculate_remaining_life_expectancy_curve),
     url(r'life-expectancy/total/(?P<sex>[^/]+)/(?P<country>[^/]+)/(?P<dob>[^/]+)/', views.total_life_expectancy),
 
     # /api/1.0/mortality-distribution/
     url(r'mortality-distribution/(?P<country>[^/]+)/(?P<sex>[^/]+)/(?P<age>[^/]+)/today/', views.calculate_mortality_distribution),
+
+    # /api/1.0/status/
+    url(r'^status/$', views.status),
 ]
@@ -1,5 +1,6 @@
-import datetime, re, math
+import datetime, re, math, json, itertools, threading
 from dateutil.relativedelta import relativedelta
+from django.utils.functional import SimpleLazyObject, empty
 
 
 
@@ -27,3 +28,40 @@ def decimal_years_to_relativedelta(years_float):
 
 def relativedelta_to_decimal_years(offset):
     return offset.years * 1.0 + offset.months / 12.0 + offset.days / 365.0
+
+def stream_json_array(items, chunk_size=1000):
+    """ Generates the JSON encoding of an iterable of items as an array in chunks, e.g. as the content of a StreamingHttpResponse """
+    items = iter(items)   # the chunks are sliced off one after another, which only works with an iterator
+    separator = ''
+    yield '['
+    for chunk in iter(lambda: [json.dumps(item) for item in itertools.islice(items, chunk_size)], []):
+        yield separator + ', '.join(chunk)
+        separator = ', '
+    yield ']'
+
+class LockedLazyObject(SimpleLazyObject):
+    """ A SimpleLazyObject which makes sure that the wrapped object is only created once, even if several threads access it at the same
+        time. Creating our objects means loading lots of data, so we'd rather have the other threads wait for the first one.
+    """
+
+    def __init__(self, func):
+        self.__dict__['_lock'] = threading.Lock()
+        super(LockedLazyObject, self).__init__(func)
+
+    def _setup(self):
+        with self._lock:
+            if self._wrapped is empty:
+                self._wrapped = self._setupfunc()
+
+_view_names = {}
+
+def view_name(view_func):
+    """ Returns the name of a view function of api.views (as resolved from a URL), or None for other functions. """
+    if not _view_names:
+        from api import views
+        _view_names.update((function, name) for name, function in vars(views).items() if callable(function))
+    return _view_names.get(view_func)
+
+def is_loaded(lazy_object):
+    """ Returns whether the object wrapped by a lazy object has been created, without creating it. """
+    return lazy_object._wrapped is not empty
@@ -1,16 +1,29 @@
 import datetime
+from collections import OrderedDict
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.settings import api_settings
 from api.datastore import dataStore
-from api.decorators import expect_date, expect_offset, expect_int, cache_until_utc_eod, cache_unlimited
-from api.utils import offset_to_str
-from api.algorithms import worldPopulationRankByDate, dateByWorldPopulationRank, lifeExpectancyRemaining, lifeExpectancyTotal, populationCount, \
-    totalPopulation, continentBirthsByDate, calculateMortalityDistribution
+from api.decorators import expect_date, expect_offset, expect_int, cache_until_utc_eod, cache_unlimited, cache_response, normalize_date, normalize_offset
+from api.exceptions import BatchParsingError, BatchTooLargeError, DataOutOfRangeError
+from api.renderers import TableRenderer, ColumnarJSONRenderer, CSVRenderer, NumpyRenderer
+from api.metrics import renderMetrics
+from api.utils import offset_to_str, stream_json_array
+from api.algorithms import worldPopulationRankByDate, worldPopulationRankByDateBatch, dateByWorldPopulationRank, lifeExpectancyRemaining, \
+    lifeExpectancyRemainingArray, lifeExpectancyTotal, populationCountColumns, populationCountRows, totalPopulation, continentBirthsByDate, calculateMortalityDistribution, isDataLoaded
+
+
+# the views which respond with tables can also render them in the compact table formats, the other views only in the default formats
+TABLE_RENDERER_CLASSES = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarJSONRenderer, CSVRenderer, NumpyRenderer)
 
 
 @api_view(['GET'])
 @cache_unlimited()
+@cache_response()
 def list_countries(request):
     """ Return a list of all countries in the statistical dataset. These are also the valid input values to the various 'country' parameters across the remaining API.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -21,6 +34,7 @@ def list_countries(request):
 @api_view(['GET'])
 @cache_until_utc_eod()
 @expect_date('dob')
+@cache_response(until_utc_eod=True)
 def world_population_rank_today(request, dob, sex, country):
     """ Calculates the world population rank of a person with the given date of birth, sex and country of origin as of today.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>Today's date is always based on the current time in the timezone UTC.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -34,6 +48,7 @@ def world_population_rank_today(request, dob, sex, country):
 @cache_unlimited()
 @expect_date('dob')
 @expect_date('date')
+@cache_response()
 def world_population_rank_by_date(request, dob, sex, country, date):
     """ Calculates the world population rank of a person with the given date of birth, sex and country of origin on a certain date.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -46,6 +61,7 @@ def world_population_rank_by_date(request, dob, sex, country, date):
 @cache_unlimited()
 @expect_date('dob')
 @expect_offset('age')
+@cache_response()
 def world_population_rank_by_age(request, dob, sex, country, age):
     """ Calculates the world population rank of a person with the given date of birth, sex and country of origin on a certain date as expressed by the person's age.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -58,6 +74,7 @@ def world_population_rank_by_age(request, dob, sex, country, age):
 @cache_until_utc_eod()
 @expect_date('dob')
 @expect_offset('offset')
+@cache_response(until_utc_eod=True)
 def world_population_rank_in_past(request, dob, sex, country, offset):
     """ Calculates the world population rank of a person with the given date of birth, sex and country of origin on a certain date as expressed by an offset towards the past from today.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>Today's date is always based on the current time in the timezone UTC.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -71,6 +88,7 @@ def world_population_rank_in_past(request, dob, sex, country, offset):
 @cache_until_utc_eod()
 @expect_date('dob')
 @expect_offset('offset')
+@cache_response(until_utc_eod=True)
 def world_population_rank_in_future(request, dob, sex, country, offset):
     """ Calculates the world population rank of a person with the given date of birth, sex and country of origin on a certain date as expressed by an offset towards the future from today.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>Today's date is always based on the current time in the timezone UTC.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -84,6 +102,7 @@ def world_population_rank_in_future(request, dob, sex, country, offset):
 @cache_unlimited()
 @expect_date('dob')
 @expect_int('rank')
+@cache_response()
 def date_by_world_population_rank(request, dob, sex, country, rank):
     """ Calculates the day on which a person with the given date of birth, sex and country of origin has reached (or will reach) a certain world population rank.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -92,10 +111,32 @@ def date_by_world_population_rank(request, dob, sex, country, rank):
     return Response({'dob': dob, 'sex': sex, 'country': country, 'rank': rank, 'date_on_rank': calcdate})
 
 
+@api_view(['POST'])
+def world_population_rank_batch(request):
+    """ Calculates the world population ranks of many persons on certain dates in a single request. Expects a JSON array of objects with the keys dob, sex, country and date, and returns the ranks in the same order.<p>The world population rank is defined as the position of someone's birthday among the group of living people of the same sex and country of origin, ordered by date of birth increasing. The first person born is assigned rank #1.<p>
+        Please see <a href="/">the full API browser</a> for more information.
+    """
+    queries = request.DATA
+    if not isinstance(queries, list):
+        raise BatchParsingError('the request body is not a JSON array')
+    if len(queries) > settings.RANK_BATCH_MAX_SIZE:
+        raise BatchTooLargeError(len(queries), settings.RANK_BATCH_MAX_SIZE)
+
+    parsed_queries = []
+    for index, query in enumerate(queries):
+        if not isinstance(query, dict) or not all(isinstance(query.get(key), basestring) for key in ('dob', 'sex', 'country', 'date')):
+            raise BatchParsingError('query #%i is not an object with the string values dob, sex, country and date' % index)
+        parsed_queries.append((query['sex'], query['country'], normalize_date('dob', query['dob']), normalize_date('date', query['date'])))
+
+    ranks = worldPopulationRankByDateBatch(parsed_queries)
+    return Response({'ranks': [{'rank': rank, 'dob': dob, 'sex': sex, 'country': country, 'date': date} for (sex, country, dob, date), rank in zip(parsed_queries, ranks)]})
+
+
 @api_view(['GET'])
 @cache_unlimited()
 @expect_date('date')
 @expect_offset('age')
+@cache_response()
 def calculate_remaining_life_expectancy(request, sex, country, date, age):
     """ Calculate remaining life expectancy of a person with given sex, country, and age at a given point in time.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -104,9 +145,30 @@ def calculate_remaining_life_expectancy(request, sex, country, date, age):
     return Response({'date': date, 'sex': sex, 'country': country, 'age': offset_to_str(age), 'remaining_life_expectancy': remaining_life_expectancy})
 
 
+@api_view(['GET'])
+@renderer_classes(TABLE_RENDERER_CLASSES)
+@cache_unlimited()
+@expect_date('date')
+@cache_response()
+def calculate_remaining_life_expectancy_curve(request, sex, country, date):
+    """ Calculate remaining life expectancy of persons with given sex and country for many ages at a given point in time in a single request. Expects the ages as the query parameter ages, separated by commas, e.g. ?ages=20y,30y,65y6m.<p>Besides JSON, the results are available in the compact formats columns, csv and npy, selected with the format query parameter.<p>
+        Please see <a href="/">the full API browser</a> for more information.
+    """
+    ages = [normalize_offset('ages', age) for age in request.QUERY_PARAMS.get('ages', '').split(',')]
+    if len(ages) > settings.LIFE_EXPECTANCY_MAX_AGES:
+        raise DataOutOfRangeError('The request contains %i ages, but only up to %i ages per request are supported' % (len(ages), settings.LIFE_EXPECTANCY_MAX_AGES))
+
+    remaining_life_expectancies = lifeExpectancyRemainingArray(sex, country, [date], ages).tolist()
+    ages = [offset_to_str(age) for age in ages]
+    if isinstance(request.accepted_renderer, TableRenderer):
+        return Response(OrderedDict([('age', ages), ('remaining_life_expectancy', remaining_life_expectancies)]))
+    return Response({'date': date, 'sex': sex, 'country': country, 'remaining_life_expectancies': [{'age': age, 'remaining_life_expectancy': value} for age, value in zip(ages, remaining_life_expectancies)]})
+
+
 @api_view(['GET'])
 @cache_unlimited()
 @expect_date('dob')
+@cache_response()
 def total_life_expectancy(request, sex, country, dob):
     """ Calculate total life expectancy of a person with given sex, country, and date of birth.<p>Note that this function is implemented based on the remaining life expectancy by picking a reference date based on an age of 35 years. It is therefore of limited accuracy.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -116,14 +178,27 @@ def total_life_expectancy(request, sex, country, dob):
 
 
 @api_view(['GET'])
+@renderer_classes(TABLE_RENDERER_CLASSES)
 @cache_unlimited()
 @expect_int('age', optional=True)
 @expect_int('year', optional=True)
+@cache_response()
 def retrieve_population_table(request, country, age=None, year=None):
-    """ Retrieve population table for age group / year / country.<p>
+    """ Retrieve population table for age group / year / country.<p>Besides JSON, the table is available in the compact formats columns (a JSON object of one array per column), csv and npy (a NumPy structured array), selected with the format query parameter, e.g. ?format=csv.<p>
         Please see <a href="/">the full API browser</a> for more information.
     """
-    result = populationCount(country, age, year)
+    columns = populationCountColumns(country, age, year)
+    if isinstance(request.accepted_renderer, TableRenderer):
+        return Response(columns)
+
+    result = list(populationCountRows(columns))
+    # plain JSON (the common case) is serialized and streamed in chunks of rows, instead of serializing the whole table at once; the rows are
+    # still stored in the response cache (see cache_response)
+    if request.accepted_renderer.format == 'json' and 'indent' not in request.accepted_media_type:
+        response = StreamingHttpResponse(stream_json_array(result), content_type=request.accepted_media_type)
+        response.cache_data = result
+        return response
+
     # FIXME: the API currently returns a flat JS array here, which is invalid JSON. The commented out line would fix this, but is currently deactivated as not to break the frontend!
     return Response(result)
     #return Response({"tables": result})
@@ -131,20 +206,27 @@ def retrieve_population_table(request, country, age=None, year=None):
 
 @api_view(['GET'])
 @cache_until_utc_eod()   # may only be cached until the day ends, as it is dependent on the current system date
+@cache_response(until_utc_eod=True)
 def retrieve_total_population_now(request, country):
     """ Retrieve total population count for country today and tomorrow.<p>
         Please see <a href="/">the full API browser</a> for more information.
     """
     today = datetime.datetime.utcnow().date()
+    return Response(total_population_today_and_tomorrow(country, today))
+
+
+def total_population_today_and_tomorrow(country, today):
+    """ Returns the response data of retrieve_total_population_now on the given day, which is also used to prepare the response cache for the next day. """
     tomorrow = today + relativedelta(days=1)
     population_today = {'date': today, 'population': totalPopulation(country, today)}
     population_tomorrow = {'date': tomorrow, 'population': totalPopulation(country, tomorrow)}
-    return Response({'total_population': [population_today, population_tomorrow]})
+    return {'total_population': [population_today, population_tomorrow]}
 
 
 @api_view(['GET'])
 @cache_unlimited()
 @expect_date('refdate')
+@cache_response()
 def retrieve_total_population(request, country, refdate):
     """ Retrieve total population count for country on given date.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -155,6 +237,7 @@ def retrieve_total_population(request, country, refdate):
 @api_view(['GET'])
 @cache_unlimited()
 @expect_date('refdate')
+@cache_response()
 def retrieve_total_population_continent(request, continent, refdate):
     """ Retrieve total population count for all countries of a continent on given date.<p>
         Please see <a href="/">the full API browser</a> for more information.
@@ -164,12 +247,39 @@ def retrieve_total_population_continent(request, continent, refdate):
 
 
 @api_view(['GET'])
-@cache_unlimited()
+@renderer_classes(TABLE_RENDERER_CLASSES)
+@cache_until_utc_eod()   # may only be cached until the day ends, as it is dependent on the current system date
 @expect_offset('age')
+@cache_response(until_utc_eod=True)
 def calculate_mortality_distribution(request, country, sex, age):
-    """ Retrieve mortality distribution for given country / sex / age.<p>
+    """ Retrieve mortality distribution for given country / sex / age.<p>Besides JSON, the distribution is available in the compact formats columns (a JSON object of one array per column), csv and npy (a NumPy structured array), selected with the format query parameter, e.g. ?format=csv.<p>
         Please see <a href="/">the full API browser</a> for more information.
     """
     plain_distribution = calculateMortalityDistribution(country, sex, age)
+    if isinstance(request.accepted_renderer, TableRenderer):
+        return Response(OrderedDict([('age', [val[0] for val in plain_distribution]), ('mortality_percent', [val[1] for val in plain_distribution])]))
     mortality_distribution = [{'age': val[0], 'mortality_percent': val[1]} for val in plain_distribution]
     return Response({'mortality_distribution': mortality_distribution})
+
+
+@api_view(['GET'])
+def status(request):
+    """ Reports whether the server is ready to answer requests, and whether it has loaded all its data, without loading anything itself. If the data is
+        preloaded (also in the background), the server only becomes ready once it has been loaded, and responds with HTTP status 503 until then, so it can
+        be used as a readiness check. Otherwise, the data is loaded by the first requests which need it, and the server is ready right away.<p>
+        Please see <a href="/">the full API browser</a> for more information.
+    """
+    loaded = isDataLoaded()
+    ready = loaded or not (settings.PRELOAD_DATA or settings.LOAD_DATA_IN_BACKGROUND)
+    return Response({'ready': ready, 'loaded': loaded}, status=200 if ready else 503)
+
+
+def metrics(request):
+    """ Reports the request, cache, model and memory statistics of this server process in the Prometheus text format, see api.metrics. Only
+        available if settings.METRICS_ENABLED is set, and only with the bearer token settings.METRICS_TOKEN if that is set.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + settings.METRICS_TOKEN):
+        return HttpResponse('The metrics need the right bearer token\n', status=403, content_type='text/plain')
+    return HttpResponse(renderMetrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
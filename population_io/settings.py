@@ -64,8 +64,10 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'api.middleware.ServerTimingMiddleware',   # needs to come first to time the whole request
     'corsheaders.middleware.CorsMiddleware',   # needs to come before CommonMiddleware
     'django.middleware.common.CommonMiddleware',
+    'api.middleware.ProfilingMiddleware',
 )
 
 ROOT_URLCONF = 'population_io.urls'
@@ -138,4 +140,53 @@ CSV_SURVIVAL_RATIO_PATH = os.path.join(BASE_DIR, 'data', 'Survival_ratio_Cohort_
 CSV_CONTINENT_COUNTRIES = os.path.join(BASE_DIR, 'data', 'continent_countries.csv')
 CSV_BIRTHS_DAY_COUNTRY = os.path.join(BASE_DIR, 'data', 'worldBirthsByDayAndCountry.csv')
 
+POPULATION_DTYPE = os.environ.get('POPULATIONIO_POPULATION_DTYPE', 'float64')
+
+MODEL_CACHE_PATH = os.environ.get('POPULATIONIO_MODEL_CACHE_LOCATION', os.path.join(BASE_DIR, 'data', 'models.npz'))
+TOTAL_POPULATION_TABLE_PATH = os.environ.get('POPULATIONIO_TOTAL_POPULATION_TABLE_LOCATION', os.path.join(BASE_DIR, 'data', 'totalpopulation.npz'))
+PRELOAD_MODELS = os.environ.get('POPULATIONIO_PRELOAD_MODELS', 'false').lower() == 'true'
+PRELOAD_DATA = os.environ.get('POPULATIONIO_PRELOAD_DATA', 'false').lower() == 'true'
+LOAD_DATA_IN_BACKGROUND = os.environ.get('POPULATIONIO_LOAD_DATA_IN_BACKGROUND', 'false').lower() == 'true'
+
 CACHE_CONTROL_MAXAGE = 24 * 60 * 60
+
+# computed responses are stored in this cache, which can be shared between processes and hosts by choosing e.g. the file based cache
+# https://docs.djangoproject.com/en/1.6/topics/cache/
+RESPONSE_CACHE_ALIAS = 'responses'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    RESPONSE_CACHE_ALIAS: {
+        'BACKEND': os.environ.get('POPULATIONIO_RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('POPULATIONIO_RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': int(os.environ.get('POPULATIONIO_RESPONSE_CACHE_TIMEOUT', CACHE_CONTROL_MAXAGE)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('POPULATIONIO_RESPONSE_CACHE_MAX_ENTRIES', 100000)),
+        },
+    },
+}
+
+RANK_BATCH_MAX_SIZE = 1000
+
+LIFE_EXPECTANCY_MAX_AGES = 1000
+
+MORTALITY_CACHE_MAX_ENTRIES = int(os.environ.get('POPULATIONIO_MORTALITY_CACHE_MAX_ENTRIES', 20000))
+MORTALITY_CACHE_MAX_BYTES = int(os.environ.get('POPULATIONIO_MORTALITY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+RANK_CACHE_MAX_ENTRIES = int(os.environ.get('POPULATIONIO_RANK_CACHE_MAX_ENTRIES', 100000))
+RANK_CACHE_MAX_BYTES = int(os.environ.get('POPULATIONIO_RANK_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# whether responses carry a Server-Timing header with the time spent in the parts of the request, see api.middleware (like /metrics, it
+# reveals internals, so it's off by default)
+SERVER_TIMING_HEADER = os.environ.get('POPULATIONIO_SERVER_TIMING', 'false').lower() == 'true'
+
+# whether /metrics reports the statistics of the server processes in the Prometheus text format (they reveal internals, so it's off by default)
+METRICS_ENABLED = os.environ.get('POPULATIONIO_METRICS', 'false').lower() == 'true'
+# if set, /metrics is only served to requests with this token in an "Authorization: Bearer" header, see api.views.metrics
+METRICS_TOKEN = os.environ.get('POPULATIONIO_METRICS_TOKEN') or None
+
+# requests with the query parameter __profile=1 and this secret in the X-Profiling-Secret header are profiled, see api.middleware
+PROFILING_SECRET = os.environ.get('POPULATIONIO_PROFILING_SECRET') or None
+# where the profiles of these requests are saved (they are only returned, if it is not set)
+PROFILING_PATH = os.environ.get('POPULATIONIO_PROFILING_LOCATION') or None
@@ -1,6 +1,7 @@
 from django.conf.urls import patterns, include, url
 from django.http.response import HttpResponse
 import api.urls
+import api.views
 
 
 API_VERSION_PREFIX = r'^1.0/'
@@ -16,6 +17,9 @@ urlpatterns = patterns('',
     # /1.0/ (API)
     url(API_VERSION_PREFIX, include(api.urls)),
 
+    # /metrics (Prometheus metrics)
+    url(r'^metrics/?$', api.views.metrics),
+
     # / (Swagger documentation)
     url(r'^$', docs_index),
 )
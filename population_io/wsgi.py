@@ -13,3 +13,13 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "population_io.settings")
 from django.core.wsgi import get_wsgi_application
 from dj_static import Cling
 application = Cling(get_wsgi_application())
+
+# load all data right away, so that it's shared by all workers when running with gunicorn --preload,
+# or start loading it in the background, so that the workers can answer health checks right away
+from django.conf import settings
+if settings.PRELOAD_DATA:
+    from api.algorithms import preload
+    preload()
+elif settings.LOAD_DATA_IN_BACKGROUND:
+    from api.algorithms import preloadInBackground
+    preloadInBackground()